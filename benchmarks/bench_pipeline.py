@@ -0,0 +1,205 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import shutil
+import resource
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gpt_optimize.gpt_optimize import CodeProcessor  # noqa: E402
+from gpt_optimize.backends import StubBackend  # noqa: E402
+from gpt_optimize.metrics import Metrics  # noqa: E402
+from gpt_optimize.rate_limiter import RateLimiter  # noqa: E402
+
+STAGES = {
+    "scheduling": ["schedule"],
+    "token_counting": ["tokens"],
+    "compaction": ["compaction"],
+    "sanitising": ["sanitise"],
+    "prettier": ["prettier"],
+    "import_checking": ["missing_imports"],
+    "saving": ["save"],
+    "api": ["api_call"],
+    "first_token": ["first_token"],
+    "throttling": ["throttle"],
+}
+
+
+class PassthroughFormatter:
+    # Used with --no-prettier when Node or Prettier are not available
+    def format(self, source, parser="babel"):
+        return True, source
+
+    def format_many(self, sources, parser="babel"):
+        return [self.format(source, parser) for source in sources]
+
+
+def generate_component(name, imports, lines):
+    header = ["import React, { useState } from 'react';"]
+    header += [f"import {module} from './{module}';" for module in imports]
+    body = [f"export default function {name}({{ items }}) {{"]
+    body.append("  const [open, setOpen] = useState(false);")
+    for index in range(max(lines - len(header) - 4, 0)):
+        body.append(
+            f"  const value{index} = items.filter((item) => item.id !== {index}).length;"
+        )
+    rendered = " ".join(f"<{module} />" for module in imports)
+    body.append(f'  return <div className="p-{len(imports)}">{rendered}</div>;')
+    body.append("}")
+    return "\n".join(header + [""] + body) + "\n"
+
+
+def generate_tree(root, files, mean_lines, size_sigma, import_density, seed=0):
+    rng = random.Random(seed)
+    names = [f"Component{index}" for index in range(files)]
+    for index, name in enumerate(names):
+        # Files only import earlier ones, which keeps the import graph acyclic
+        candidates = names[:index]
+        imports = [module for module in candidates if rng.random() < import_density]
+        lines = max(int(rng.lognormvariate(0, size_sigma) * mean_lines), 8)
+        with open(os.path.join(root, f"{name}.jsx"), "w", encoding="utf-8") as file:
+            file.write(generate_component(name, imports[:10], lines))
+
+
+def run(args):
+    work_dir = tempfile.mkdtemp(prefix="gpt_optimize_bench_")
+    input_dir = os.path.join(work_dir, "input")
+    os.makedirs(input_dir)
+    generate_tree(
+        input_dir,
+        args.files,
+        args.mean_lines,
+        args.size_sigma,
+        args.import_density,
+        args.seed,
+    )
+
+    metrics = Metrics()
+    processor = CodeProcessor(
+        logger=logging.getLogger("bench"),
+        metrics=metrics,
+        backend=StubBackend(
+            latency=args.latency,
+            latency_jitter=args.latency_jitter,
+            error_rate=args.error_rate,
+            truncate_rate=args.truncate_rate,
+            seed=args.seed,
+            chars_per_second=args.chars_per_second,
+        ),
+        rate_limiter=RateLimiter(limits={}, default_limits=(args.rpm, args.tpm)),
+        stream=args.stream,
+        compact_operations=args.compact.split(",") if args.compact else (),
+    )
+    if args.no_prettier:
+        processor.openai.formatter = PassthroughFormatter()
+        processor.openai.validation_pipeline.stages[0].formatter = (
+            processor.openai.formatter
+        )
+
+    # MissingImport resolves "input" against the codebase path, so run from
+    # the work dir with a relative input path
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    started_at = time.perf_counter()
+    try:
+        processor.count_directory_tokens("input")
+        if args.concurrency > 1:
+            asyncio.run(
+                processor.process_directory_async(
+                    "input",
+                    "output",
+                    code_base_path=input_dir,
+                    concurrency=args.concurrency,
+                )
+            )
+        else:
+            processor.process_directory("input", "output", code_base_path=input_dir)
+    finally:
+        elapsed = time.perf_counter() - started_at
+        os.chdir(cwd)
+        if not args.keep_tree:
+            shutil.rmtree(work_dir)
+
+    summary = metrics.summary()
+    stage_times = {
+        stage: sum(
+            summary["stages"].get(name, {}).get("total", 0) or 0 for name in names
+        )
+        for stage, names in STAGES.items()
+    }
+    return {
+        "config": vars(args),
+        "wall_time": elapsed,
+        "files": summary["files"],
+        "files_per_second": summary["files"] / elapsed,
+        "tokens": summary["total_tokens"],
+        "tokens_per_second": summary["total_tokens"] / elapsed,
+        "tokens_saved": summary["tokens_saved"],
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "stage_seconds": stage_times,
+        "stages": summary["stages"],
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark process_directory on a synthetic tree against the stub backend."
+    )
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--mean-lines", type=int, default=80)
+    parser.add_argument("--size-sigma", type=float, default=0.5)
+    parser.add_argument("--import-density", type=float, default=0.05)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--latency-jitter", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--truncate-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--chars-per-second",
+        type=float,
+        default=0,
+        help="Simulated generation speed of the stub; 0 answers at once.",
+    )
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument(
+        "--compact",
+        default="",
+        help="Comma separated operations to compact, e.g. optimise,validate.",
+    )
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--rpm", type=int, default=1000000)
+    parser.add_argument("--tpm", type=int, default=1000000000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--no-prettier",
+        action="store_true",
+        help="Skip Prettier, for machines without Node.",
+    )
+    parser.add_argument(
+        "--keep-tree",
+        action="store_true",
+        help="Keep the generated input and output trees for inspection.",
+    )
+    parser.add_argument("--output", default="bench_results.json")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = run(args)
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+    print(
+        f"{results['files']} files in {results['wall_time']:.2f}s: "
+        f"{results['files_per_second']:.2f} files/s, "
+        f"{results['tokens_per_second']:.0f} tokens/s, "
+        f"peak RSS {results['peak_rss_mb']:.0f} MB"
+    )
+    for stage, seconds in results["stage_seconds"].items():
+        print(f"  {stage}: {seconds:.3f}s")
@@ -0,0 +1,322 @@
+import json
+import time
+import random
+import asyncio
+import hashlib
+import threading
+
+
+class ResponseObject(dict):
+    # Gives plain dicts the attribute access of openai's response objects
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def to_response(value):
+    if isinstance(value, dict):
+        return ResponseObject({key: to_response(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return [to_response(item) for item in value]
+    return value
+
+
+def messages_key(messages):
+    return hashlib.sha256(
+        json.dumps(messages, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+class LLMBackend:
+    def chat(self, model, messages, temperature):
+        raise NotImplementedError
+
+    def stream_chat(self, model, messages, temperature):
+        # Yields (text, finish_reason) pieces; finish_reason is set on the
+        # last one. Backends without streaming answer in a single piece.
+        response = self.chat(model, messages, temperature)
+        choice = response.choices[0]
+        yield choice.message.content, choice.finish_reason
+
+    async def achat(self, model, messages, temperature):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.chat, model, messages, temperature)
+
+
+class OpenAiBackend(LLMBackend):
+    def __init__(self, api_key, api_base=None):
+        self.api_key = api_key
+        self.api_base = api_base
+
+    def _options(self):
+        options = {"api_key": self.api_key}
+        if self.api_base is not None:
+            options["api_base"] = self.api_base
+        return options
+
+    def chat(self, model, messages, temperature):
+        import openai
+
+        return openai.ChatCompletion.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            **self._options(),
+        )
+
+    async def achat(self, model, messages, temperature):
+        import openai
+
+        return await openai.ChatCompletion.acreate(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            **self._options(),
+        )
+
+    def stream_chat(self, model, messages, temperature):
+        import openai
+
+        for chunk in openai.ChatCompletion.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            stream=True,
+            **self._options(),
+        ):
+            choice = chunk["choices"][0]
+            yield choice["delta"].get("content", ""), choice.get("finish_reason")
+
+
+class OpenAiCompatibleBackend(OpenAiBackend):
+    def __init__(self, base_url, api_key=None):
+        # Most compatible servers ignore the key but the client requires one
+        super().__init__(api_key or "none", api_base=base_url.rstrip("/"))
+
+
+class RecordingBackend(LLMBackend):
+    def __init__(self, backend, recording_path):
+        self.backend = backend
+        self.recording_path = recording_path
+        self._lock = threading.Lock()
+
+    def _record(self, messages, response):
+        choice = response.choices[0]
+        self._write(messages, choice.message.content, choice.finish_reason)
+
+    def _write(self, messages, content, finish_reason):
+        record = {
+            "key": messages_key(messages),
+            "content": content,
+            "finish_reason": finish_reason,
+        }
+        with self._lock:
+            with open(self.recording_path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(record) + "\n")
+
+    def chat(self, model, messages, temperature):
+        response = self.backend.chat(model, messages, temperature)
+        self._record(messages, response)
+        return response
+
+    async def achat(self, model, messages, temperature):
+        response = await self.backend.achat(model, messages, temperature)
+        self._record(messages, response)
+        return response
+
+    def stream_chat(self, model, messages, temperature):
+        pieces = []
+        for text, finish_reason in self.backend.stream_chat(
+            model, messages, temperature
+        ):
+            pieces.append(text)
+            if finish_reason is not None:
+                # Aborted streams never get here and are not recorded
+                self._write(messages, "".join(pieces), finish_reason)
+            yield text, finish_reason
+
+
+class StubRateLimitError(Exception):
+    http_status = 429
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.headers = {"retry-after": str(retry_after)}
+
+
+class StubBackend(LLMBackend):
+    # Deterministic local stand-in for the API. It replays recorded responses
+    # when it has one for the conversation, otherwise it answers validation
+    # requests with "valid." and echoes the submitted code. Latency, rate
+    # limit errors and length truncations are simulated, as is the generation
+    # speed when chars_per_second is set.
+    def __init__(
+        self,
+        latency=0.0,
+        latency_jitter=0.0,
+        error_rate=0.0,
+        truncate_rate=0.0,
+        recording_path=None,
+        seed=0,
+        chars_per_second=0,
+        stream_chunk_chars=32,
+    ):
+        self.latency = latency
+        self.chars_per_second = chars_per_second
+        self.stream_chunk_chars = stream_chunk_chars
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.truncate_rate = truncate_rate
+        self.seed = seed
+        self.recordings = self._load_recordings(recording_path)
+        self._calls = {}
+        self._remainders = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _load_recordings(recording_path):
+        recordings = {}
+        if recording_path is None:
+            return recordings
+        with open(recording_path, "r", encoding="utf-8") as file:
+            for line in file:
+                record = json.loads(line)
+                recordings.setdefault(record["key"], []).append(record)
+        return recordings
+
+    def _random(self, key):
+        # Seeded per conversation and per attempt, so runs are reproducible
+        # whatever order concurrent workers call in
+        with self._lock:
+            self._calls[key] = self._calls.get(key, 0) + 1
+            attempt = self._calls[key]
+        return random.Random(f"{self.seed}:{key}:{attempt}"), attempt
+
+    def _respond(self, model, messages, rng, attempt, key):
+        if rng.random() < self.error_rate:
+            raise StubRateLimitError("Stub rate limit reached", retry_after=0.1)
+
+        with self._lock:
+            remainder = self._remainders.pop(messages[-1]["content"], None)
+
+        if remainder is not None:
+            content, finish_reason = remainder, "stop"
+        elif key in self.recordings:
+            records = self.recordings[key]
+            record = records[(attempt - 1) % len(records)]
+            content, finish_reason = record["content"], record["finish_reason"]
+        elif "validate" in messages[0]["content"]:
+            content, finish_reason = "valid.", "stop"
+        else:
+            code = (
+                messages[2]["content"] if len(messages) > 2 else messages[-1]["content"]
+            )
+            content, finish_reason = f"```jsx\n{code}\n```", "stop"
+
+        if (
+            finish_reason == "stop"
+            and len(content) > 1
+            and rng.random() < self.truncate_rate
+        ):
+            cut = len(content) // 2
+            content, rest = content[:cut], content[cut:]
+            finish_reason = "length"
+            with self._lock:
+                self._remainders[content] = rest
+
+        prompt_tokens = sum(len(message["content"]) for message in messages) // 4
+        completion_tokens = len(content) // 4
+        return to_response(
+            {
+                "id": f"chatcmpl-stub-{key[:12]}-{attempt}",
+                "object": "chat.completion",
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": finish_reason,
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            }
+        )
+
+    def _delay(self, rng):
+        return max(self.latency + rng.uniform(-1, 1) * self.latency_jitter, 0)
+
+    def _generation_time(self, text):
+        if not self.chars_per_second:
+            return 0
+        return len(text) / self.chars_per_second
+
+    def chat(self, model, messages, temperature):
+        key = messages_key(messages)
+        rng, attempt = self._random(key)
+        time.sleep(self._delay(rng))
+        response = self._respond(model, messages, rng, attempt, key)
+        time.sleep(self._generation_time(response.choices[0].message.content))
+        return response
+
+    async def achat(self, model, messages, temperature):
+        key = messages_key(messages)
+        rng, attempt = self._random(key)
+        await asyncio.sleep(self._delay(rng))
+        response = self._respond(model, messages, rng, attempt, key)
+        await asyncio.sleep(self._generation_time(response.choices[0].message.content))
+        return response
+
+    def stream_chat(self, model, messages, temperature):
+        key = messages_key(messages)
+        rng, attempt = self._random(key)
+        time.sleep(self._delay(rng))
+        response = self._respond(model, messages, rng, attempt, key)
+        choice = response.choices[0]
+        content = choice.message.content
+        size = max(self.stream_chunk_chars, 1)
+        for start in range(0, len(content), size):
+            piece = content[start : start + size]
+            time.sleep(self._generation_time(piece))
+            last = start + size >= len(content)
+            yield piece, choice.finish_reason if last else None
+        if not content:
+            yield "", choice.finish_reason
+
+
+def create_backend(
+    name,
+    api_key=None,
+    base_url=None,
+    latency=0.0,
+    error_rate=0.0,
+    truncate_rate=0.0,
+    recording_path=None,
+    chars_per_second=0,
+    record_path=None,
+):
+    if name == "openai":
+        backend = OpenAiBackend(api_key)
+    elif name == "compatible":
+        if not base_url:
+            raise ValueError("The compatible backend needs a base URL")
+        backend = OpenAiCompatibleBackend(base_url, api_key)
+    elif name == "stub":
+        backend = StubBackend(
+            latency=latency,
+            error_rate=error_rate,
+            truncate_rate=truncate_rate,
+            recording_path=recording_path,
+            chars_per_second=chars_per_second,
+        )
+    else:
+        raise ValueError(f"Unknown backend: {name}")
+    if record_path:
+        # Every response is appended to record_path for the stub to replay
+        backend = RecordingBackend(backend, record_path)
+    return backend
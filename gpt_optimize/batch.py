@@ -0,0 +1,211 @@
+import os
+import json
+import hashlib
+import argparse
+from .utils_func import sanitize_code_blocks
+from .validation import ValidationPipeline
+from .metrics import current_file
+from .manifest import Manifest
+
+
+class BatchProcessor:
+    def __init__(self, processor, operation="optimise", temperature=0.5):
+        self.processor = processor
+        self.openai = processor.openai
+        self.logger = processor.logger
+        self.operation = operation
+        self.temperature = temperature
+        # Ingesting stays offline: only the local validation stages are run
+        self.validation_pipeline = ValidationPipeline(
+            [
+                stage
+                for stage in self.openai.validation_pipeline.stages
+                if stage.name != "ai_review"
+            ],
+            self.logger,
+            self.openai.metrics,
+        )
+
+    @staticmethod
+    def make_custom_id(operation, relative_path, code):
+        code_hash = hashlib.sha256(code.encode("utf-8")).hexdigest()[:12]
+        return f"{operation}:{relative_path}:{code_hash}"
+
+    @staticmethod
+    def parse_custom_id(custom_id):
+        operation, rest = custom_id.split(":", 1)
+        relative_path, code_hash = rest.rsplit(":", 1)
+        return operation, relative_path, code_hash
+
+    def emit(self, input_dir_path, batch_path, limit=None):
+        count = 0
+        with open(batch_path, "w", encoding="utf-8") as batch_file:
+            for input_path, _ in self.processor.iter_files(
+                input_dir_path, input_dir_path, limit
+            ):
+                with open(input_path, "r", encoding="utf-8") as file:
+                    code = file.read()
+                messages = self.openai.create_messages(
+                    self.openai._prepare_system_content(self.operation),
+                    self.openai._prepare_user_content(self.operation),
+                    code,
+                )
+                try:
+                    model = self.openai.route_model(
+                        self.operation, messages, self.processor.model
+                    )
+                except Exception as e:
+                    self.logger.warning(f"Not batching {input_path}: {e}")
+                    self.processor.log_to_file(input_path)
+                    continue
+                request = {
+                    "custom_id": self.make_custom_id(
+                        self.operation,
+                        os.path.relpath(input_path, input_dir_path),
+                        code,
+                    ),
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {
+                        "model": model,
+                        "messages": messages,
+                        "temperature": self.temperature,
+                    },
+                }
+                batch_file.write(json.dumps(request) + "\n")
+                count += 1
+        self.logger.info(f"Wrote {count} batch requests to {batch_path}")
+        return count
+
+    def ingest(
+        self, results_path, input_dir_path, output_dir_path, code_base_path=None
+    ):
+        counts = {"success": 0, "failed": 0, "skipped": 0}
+        with open(results_path, "r", encoding="utf-8") as results_file:
+            for line in results_file:
+                if not line.strip():
+                    continue
+                status = self.ingest_result(
+                    json.loads(line), input_dir_path, output_dir_path, code_base_path
+                )
+                counts[status] += 1
+        self.processor.output.flush()
+        self.logger.info(f"Ingested batch results: {counts}")
+        return counts
+
+    def ingest_result(self, result, input_dir_path, output_dir_path, code_base_path):
+        operation, relative_path, code_hash = self.parse_custom_id(result["custom_id"])
+        input_path = os.path.join(input_dir_path, relative_path)
+        output_path = self.processor.replace_input_with_output(
+            input_path, input_dir_path, output_dir_path
+        )
+        token = current_file.set(input_path)
+        try:
+            with open(input_path, "r", encoding="utf-8") as file:
+                code = file.read()
+            if (
+                self.make_custom_id(operation, relative_path, code)
+                != result["custom_id"]
+            ):
+                self.logger.warning(
+                    f"Input changed since the batch was emitted: {input_path}"
+                )
+                return "skipped"
+
+            content = self._response_content(result)
+            if content is None:
+                self.processor.log_to_file(input_path)
+                return self._record(input_path, output_path, "failed")
+
+            validation = self.validation_pipeline.run(
+                sanitize_code_blocks(content), code
+            )
+            if not validation.valid:
+                self.logger.warning(
+                    f"Invalid batch result for {input_path}: {validation.feedback}"
+                )
+                self.processor.log_to_file(input_path)
+                return self._record(input_path, output_path, "failed")
+
+            self.processor.save_code(validation.code, output_path)
+            if code_base_path:
+                self.processor.missing_imports.create(
+                    input_path, output_path, code_base_path, validation.code
+                )
+            return self._record(input_path, output_path, "success")
+        finally:
+            current_file.reset(token)
+
+    def _response_content(self, result):
+        response = result.get("response") or {}
+        if result.get("error") or response.get("status_code") != 200:
+            self.logger.warning(f"Batch request failed: {result.get('error')}")
+            return None
+        choice = response["body"]["choices"][0]
+        if choice["finish_reason"] != "stop":
+            # Continuations need another round trip, which a batch cannot do
+            self.logger.warning(f"Unusable finish reason: {choice['finish_reason']}")
+            return None
+        return choice["message"]["content"]
+
+    def _record(self, input_path, output_path, status):
+        # Hashed the way the manifest checks it: raw bytes, not decoded text
+        self.processor.record_manifest(
+            input_path,
+            Manifest.hash_file(input_path),
+            status,
+            output_path,
+        )
+        return status
+
+
+def respond_locally(batch_path, results_path):
+    # Stand-in for the batch API: answers every request with its own code in
+    # a fenced block, in the same result format
+    with open(batch_path, "r", encoding="utf-8") as batch_file, open(
+        results_path, "w", encoding="utf-8"
+    ) as results_file:
+        for index, line in enumerate(batch_file):
+            request = json.loads(line)
+            code = request["body"]["messages"][-1]["content"]
+            body = {
+                "id": f"chatcmpl-local-{index}",
+                "object": "chat.completion",
+                "model": request["body"]["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {
+                            "role": "assistant",
+                            "content": f"```jsx\n{code}\n```",
+                        },
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                    "total_tokens": 0,
+                },
+            }
+            result = {
+                "id": f"batch_req_{index}",
+                "custom_id": request["custom_id"],
+                "response": {
+                    "status_code": 200,
+                    "request_id": f"local-{index}",
+                    "body": body,
+                },
+                "error": None,
+            }
+            results_file.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Produce a batch results file locally, without calling the API."
+    )
+    parser.add_argument("batch", help="Requests file written by main.py --emit-batch.")
+    parser.add_argument("results", help="Results file to pass to --ingest-batch.")
+    args = parser.parse_args()
+    respond_locally(args.batch, args.results)
@@ -0,0 +1,72 @@
+import time
+import threading
+
+
+class FileBudget:
+    def __init__(self, max_iterations=4, max_tokens=60000, max_seconds=600):
+        self.max_iterations = max_iterations
+        self.max_tokens = max_tokens
+        self.max_seconds = max_seconds
+        self.started_at = time.monotonic()
+        self.tokens = 0
+        # Validation rounds of the file, across retries of the calls
+        self.iterations = 0
+        self.degraded = False
+        self._lock = threading.Lock()
+
+    def add_tokens(self, tokens):
+        with self._lock:
+            self.tokens += tokens
+
+    def add_iteration(self):
+        with self._lock:
+            self.iterations += 1
+            return self.iterations
+
+    def elapsed(self):
+        return time.monotonic() - self.started_at
+
+    def exhausted(self, include_iterations=True):
+        if (
+            include_iterations
+            and self.max_iterations
+            and self.iterations >= self.max_iterations
+        ):
+            return "iterations"
+        if self.max_tokens and self.tokens >= self.max_tokens:
+            return "tokens"
+        if self.max_seconds and self.elapsed() >= self.max_seconds:
+            return "time"
+        return None
+
+    def split(self, parts):
+        # One budget per chunk of the file
+        return [ChunkBudget(self) for _ in range(parts)]
+
+
+class ChunkBudget(FileBudget):
+    # A chunk gets the validation rounds and tokens of a whole file, so a
+    # large file is not starved by its own size; the clock stays the file's
+    # and the file adds up the tokens and degradation of its chunks
+    def __init__(self, file_budget):
+        self.file_budget = file_budget
+        super().__init__(
+            file_budget.max_iterations,
+            file_budget.max_tokens,
+            file_budget.max_seconds,
+        )
+        self.started_at = file_budget.started_at
+
+    def add_tokens(self, tokens):
+        super().add_tokens(tokens)
+        self.file_budget.add_tokens(tokens)
+
+    @property
+    def degraded(self):
+        return self._degraded
+
+    @degraded.setter
+    def degraded(self, degraded):
+        self._degraded = degraded
+        if degraded:
+            self.file_budget.degraded = True
@@ -0,0 +1,133 @@
+from .js_tokenizer import tokenize, NAME, PUNCT, TEMPLATE, COMMENT
+
+DECLARATION_KEYWORDS = {
+    "import",
+    "export",
+    "function",
+    "async",
+    "const",
+    "let",
+    "var",
+    "class",
+    "interface",
+    "type",
+    "enum",
+    "declare",
+    "abstract",
+}
+_MODIFIERS = {"export", "default", "async", "declare", "abstract"}
+_DECLARATORS = {"function", "class", "const", "let", "var", "interface", "type", "enum"}
+_OPENING = set("{([")
+_CLOSING = set("})]")
+
+
+def _depth_delta(token):
+    if token.kind == PUNCT:
+        return (token.value in _OPENING) - (token.value in _CLOSING)
+    if token.kind == TEMPLATE:
+        return token.value.endswith("${") - token.value.startswith("}")
+    return 0
+
+
+def split_module(source):
+    # Splits a JS/TS module into its import header and top-level declarations.
+    # A declaration starts on a line whose first token is a declaration keyword
+    # at nesting depth 0; anything in between (comments, statements) stays
+    # attached to the preceding declaration.
+    tokens = [token for token in tokenize(source) if token.kind != COMMENT]
+    boundaries = []
+    depth = 0
+    for position, token in enumerate(tokens):
+        line_start = source.rfind("\n", 0, token.start) + 1
+        if (
+            depth == 0
+            and token.kind == NAME
+            and token.value in DECLARATION_KEYWORDS
+            and not source[line_start : token.start].strip()
+        ):
+            next_token = tokens[position + 1] if position + 1 < len(tokens) else None
+            is_import = token.value == "import" and (
+                next_token is None or next_token.value not in ("(", ".")
+            )
+            boundaries.append((line_start, is_import))
+        depth += _depth_delta(token)
+
+    if not boundaries:
+        return [source], []
+
+    header = [source[: boundaries[0][0]]] if boundaries[0][0] else []
+    segments = []
+    for position, (start, is_import) in enumerate(boundaries):
+        end = boundaries[position + 1][0] if position + 1 < len(boundaries) else None
+        segment = source[start:end]
+        if is_import and not segments:
+            header.append(segment)
+        else:
+            segments.append(segment)
+    return header, segments
+
+
+def chunk_module(source, max_tokens, count_tokens):
+    header, segments = split_module(source)
+    header = "".join(header)
+    budget = max(max_tokens - count_tokens(header), 1)
+
+    chunks = []
+    current = []
+    current_tokens = 0
+    for segment in segments:
+        segment_tokens = count_tokens(segment)
+        if current and current_tokens + segment_tokens > budget:
+            chunks.append("".join(current))
+            current = []
+            current_tokens = 0
+        current.append(segment)
+        current_tokens += segment_tokens
+    if current:
+        chunks.append("".join(current))
+    return header, chunks
+
+
+def declared_name(segment):
+    tokens = [token for token in tokenize(segment) if token.kind != COMMENT]
+    for position, token in enumerate(tokens):
+        if token.kind == NAME and token.value in _MODIFIERS:
+            continue
+        if token.kind == NAME and token.value in _DECLARATORS:
+            for candidate in tokens[position + 1 : position + 3]:
+                if candidate.kind == NAME:
+                    return candidate.value
+        return None
+    return None
+
+
+def _normalise(text):
+    return " ".join(text.split())
+
+
+def stitch_chunks(outputs):
+    header = []
+    seen_imports = set()
+    body = []
+    seen_names = set()
+    seen_segments = set()
+
+    for output in outputs:
+        output_header, segments = split_module(output)
+        for segment in output_header:
+            if _normalise(segment) and _normalise(segment) not in seen_imports:
+                seen_imports.add(_normalise(segment))
+                header.append(segment.strip())
+        for segment in segments:
+            # Helpers the model re-creates in several chunks are kept once
+            name = declared_name(segment)
+            if _normalise(segment) in seen_segments or (
+                name is not None and name in seen_names
+            ):
+                continue
+            seen_segments.add(_normalise(segment))
+            if name is not None:
+                seen_names.add(name)
+            body.append(segment.strip())
+
+    return "\n".join(header) + "\n\n" + "\n\n".join(body) + "\n"
@@ -0,0 +1,114 @@
+import re
+from .js_tokenizer import tokenize, NAME, STRING, PUNCT, COMMENT
+from .import_scanner import is_relative
+
+# Comments the tooling reads (eslint, prettier, @ts-ignore, /*! licences, ...)
+_DIRECTIVE = re.compile(r"^(//|/\*)\s*([@!#]|eslint|prettier|istanbul|webpack)")
+
+
+def compact_prompt(text):
+    # The prompts are indented like the code around them; the model does not
+    # need the indentation or the blank lines
+    lines = (" ".join(line.split()) for line in text.split("\n"))
+    return "\n".join(line for line in lines if line)
+
+
+class Compaction:
+    # Code as it is sent to the model, and the mapping from its placeholders
+    # back to the literals they stand for
+    def __init__(self, code, literals):
+        self.code = code
+        self.literals = literals
+
+    def restore(self, code):
+        # The model may have changed the quotes around a placeholder, the
+        # original literal is put back as it was
+        if not code or not self.literals:
+            return code
+        return self._pattern().sub(
+            lambda match: self.literals.get(match.group(2), match.group(0)), code
+        )
+
+    def _pattern(self):
+        # Relative specifiers keep their last segment after the placeholder
+        names = "|".join(re.escape(name) for name in self.literals)
+        return re.compile(rf"(['\"`])({names})(?:/[^'\"`\n]*)?\1")
+
+
+def _is_specifier(tokens, index):
+    # import x from "..." / export ... from "..." / import "..." /
+    # require("...") / import("...")
+    previous = tokens[index - 1] if index > 0 else None
+    if previous is None:
+        return False
+    if previous.kind == NAME and previous.value in ("from", "import"):
+        return True
+    if previous.kind == PUNCT and previous.value == "(" and index > 1:
+        return tokens[index - 2].value in ("require", "import")
+    return False
+
+
+def _removable(source, tokens, index):
+    # Only comments starting a line, or alone in a JSX expression, are dropped.
+    # The tokenizer does not know about JSX text, so a "//" in the middle of
+    # a line may well be part of a URL.
+    token = tokens[index]
+    if _DIRECTIVE.match(token.value):
+        return False
+    line_start = source.rfind("\n", 0, token.start) + 1
+    if not source[line_start : token.start].strip():
+        return True
+    return (
+        token.value.startswith("/*")
+        and 0 < index < len(tokens) - 1
+        and tokens[index - 1].value == "{"
+        and tokens[index + 1].value == "}"
+    )
+
+
+def compact_code(source, min_literal_length=48):
+    # Drops comments, indentation, trailing whitespace and blank lines, and
+    # swaps relative module specifiers and long single-word literals (URLs,
+    # data URIs, hashes) for short placeholders restored once the model
+    # answered. Package names stay visible, the prompt asks the model to
+    # replace some of them. A relative specifier keeps its last segment, e.g.
+    # "__s0__/Button", so it still lines up with the dependency context.
+    # Strings, template literals and regexes are otherwise left untouched.
+    tokens = tokenize(source)
+    prefix = "__s" if "__s" not in source else "__gpto_s"
+    literals = {}
+    names = {}
+    parts = []
+    previous = None
+    removed = False
+    for index, token in enumerate(tokens):
+        if token.kind == COMMENT and _removable(source, tokens, index):
+            removed = True
+            continue
+        if previous is not None:
+            between = source[previous.end : token.start]
+            if "\n" in between:
+                parts.append("\n")
+            elif not removed:
+                parts.append(between)
+        previous, removed = token, False
+
+        text = token.value
+        if token.kind == STRING and len(text) > 2 and text[0] == text[-1]:
+            value = text[1:-1]
+            suffix = None
+            if _is_specifier(tokens, index):
+                if is_relative(value):
+                    suffix = "/" + value.rsplit("/", 1)[-1]
+            elif len(text) >= min_literal_length and not any(
+                char.isspace() for char in value
+            ):
+                suffix = ""
+            if suffix is not None:
+                name = names.get(text) or f"{prefix}{len(names)}__"
+                if len(name) + len(suffix) + 2 < len(text):
+                    names[text] = name
+                    literals[name] = text
+                    text = f"{text[0]}{name}{suffix}{text[0]}"
+        parts.append(text)
+    return Compaction("".join(parts) + "\n", literals)
@@ -0,0 +1,111 @@
+import zlib
+import hashlib
+from collections import namedtuple
+from .js_tokenizer import tokenize, COMMENT
+
+# duplicates: representative -> files with the same normalised content
+# near: file -> representative it is a near-duplicate of
+FileGroups = namedtuple("FileGroups", ["duplicates", "near"])
+
+
+def normalised_tokens(source):
+    # Whitespace and comments do not change what the optimiser is given, but
+    # line breaks can change the program through semicolon insertion
+    # ("return\nx" is not "return x"), so each run of them is kept as one
+    tokens = []
+    previous_end = None
+    for token in tokenize(source):
+        if token.kind == COMMENT:
+            continue
+        if previous_end is not None and "\n" in source[previous_end : token.start]:
+            tokens.append("\n")
+        tokens.append(token.value)
+        previous_end = token.end
+    return tokens
+
+
+def content_hash(tokens):
+    return hashlib.sha256("\x00".join(tokens).encode("utf-8")).hexdigest()
+
+
+def sketch(tokens, bins=64, shingle_size=5):
+    # One-permutation MinHash: every token shingle is hashed once and only the
+    # smallest hash of each bin is kept
+    signature = [None] * bins
+    for start in range(max(len(tokens) - shingle_size + 1, 1)):
+        window = "\x00".join(tokens[start : start + shingle_size])
+        value = zlib.crc32(window.encode("utf-8"))
+        index, value = value % bins, value // bins
+        if signature[index] is None or value < signature[index]:
+            signature[index] = value
+    return tuple(signature)
+
+
+def similarity(first, second):
+    # Estimated Jaccard similarity of the shingle sets
+    compared = [(a, b) for a, b in zip(first, second) if a is not None or b is not None]
+    if not compared:
+        return 1.0
+    return sum(a == b for a, b in compared) / len(compared)
+
+
+class Deduplicator:
+    def __init__(
+        self, near_threshold=None, bins=64, bands=16, shingle_size=5, min_tokens=50
+    ):
+        self.near_threshold = near_threshold
+        self.bins = bins
+        self.bands = bands
+        self.shingle_size = shingle_size
+        # Small files look alike whatever they do
+        self.min_tokens = min_tokens
+
+    def _band_keys(self, signature):
+        rows = self.bins // self.bands
+        for band in range(self.bands):
+            values = signature[band * rows : (band + 1) * rows]
+            if any(value is not None for value in values):
+                yield band, values
+
+    def group(self, paths, contexts=None):
+        # contexts maps a path to the rest of its prompt (its dependency
+        # exports); only files sent the same prompt are duplicates
+        contexts = contexts or {}
+        by_hash = {}
+        sketches = {}
+        for path in sorted(paths):
+            with open(path, "r", encoding="utf-8", errors="replace") as file:
+                tokens = normalised_tokens(file.read())
+            key = content_hash(tokens + ["\x00", contexts.get(path) or ""])
+            by_hash.setdefault(key, []).append(path)
+            if self.near_threshold is not None and len(tokens) >= self.min_tokens:
+                sketches[path] = sketch(tokens, self.bins, self.shingle_size)
+
+        duplicates = {
+            group[0]: group[1:] for group in by_hash.values() if len(group) > 1
+        }
+        near = {}
+        if self.near_threshold is None:
+            return FileGroups(duplicates, near)
+
+        # Locality-sensitive hashing over bands of the sketches, so only files
+        # sharing a band are compared
+        buckets = {}
+        for path in sorted(group[0] for group in by_hash.values()):
+            signature = sketches.get(path)
+            if signature is None:
+                continue
+            keys = list(self._band_keys(signature))
+            candidates = {
+                candidate for key in keys for candidate in buckets.get(key, ())
+            }
+            best = max(
+                ((similarity(signature, sketches[c]), c) for c in candidates),
+                default=None,
+            )
+            if best is not None and best[0] >= self.near_threshold:
+                near[path] = best[1]
+                continue
+            for key in keys:
+                buckets.setdefault(key, []).append(path)
+        return FileGroups(duplicates, near)
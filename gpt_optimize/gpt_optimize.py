@@ -1,49 +1,200 @@
 import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from .missing_import import MissingImport
+from .import_index import ImportIndex
+from .module_graph import ModuleGraph
+from .scheduler import topological_waves, export_signatures, dependency_context
+from .dedup import Deduplicator
+from .output_writer import TreeWriter
+from .model_router import ModelTooSmallError
 from .openai_helper import OpenAiHelper
+from .budget import FileBudget
+from .metrics import Metrics, current_file
+from .streaming import partial_output
 
 
 class CodeProcessor:
-    def __init__(self, logger, model="gpt-3.5-turbo-0613"):
+    _log_lock = threading.Lock()
+
+    def __init__(
+        self,
+        logger,
+        model=None,
+        cache=None,
+        manifest=None,
+        incremental=False,
+        rate_limiter=None,
+        max_iterations=4,
+        max_file_tokens=60000,
+        max_file_seconds=600,
+        metrics=None,
+        backend=None,
+        import_index_path=None,
+        stream=False,
+        dedup=False,
+        near_duplicate_threshold=None,
+        output_writer=None,
+        compact_operations=(),
+        router=None,
+        chunk_tokens=4000,
+    ):
         self.logger = logger
         self.model = model
-        self.openai = OpenAiHelper(self.model, self.logger)
-        self.missing_imports = MissingImport(logger=self.logger)
+        self.metrics = metrics or Metrics()
+        self.output = output_writer or TreeWriter()
+        self.manifest = manifest
+        self.incremental = incremental
+        self.max_iterations = max_iterations
+        self.max_file_tokens = max_file_tokens
+        self.max_file_seconds = max_file_seconds
+        self.openai = OpenAiHelper(
+            self.model,
+            self.logger,
+            cache=cache,
+            rate_limiter=rate_limiter,
+            metrics=self.metrics,
+            backend=backend,
+            stream=stream,
+            compact_operations=compact_operations,
+            router=router,
+            chunk_tokens=chunk_tokens,
+        )
+        self.missing_imports = MissingImport(
+            logger=self.logger, index_path=import_index_path
+        )
+        # Export signatures of optimised files, fed to the files importing them
+        self.signatures = {}
+        self.dedup = dedup or near_duplicate_threshold is not None
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self.duplicates = {}
+        self.near_duplicates = {}
+        self.near_representatives = set()
+        self.results = {}
 
     @staticmethod
     def log_to_file(file_path, log_file="failed_files.txt"):
-        with open(log_file, "a") as file:
-            file.write(f"{file_path}\n")
+        with CodeProcessor._log_lock:
+            with open(log_file, "a") as file:
+                file.write(f"{file_path}\n")
+
+    def model_version(self):
+        # What the manifest records as the model: the model asked for, or the
+        # routing tables that picked it
+        return self.model or f"router:{self.openai.router.version()}"
+
+    def record_manifest(
+        self, input_path, input_hash, status, output_path, context=None
+    ):
+        # Recorded once the output is written, so a crash before the writer
+        # flushes cannot leave a "success" pointing at a stale output
+        if self.manifest is None:
+            return
+        prompt_version = self.openai.prompt_version(context=context)
+        model_version = self.model_version()
+        self.output.when_written(
+            output_path,
+            lambda: self.manifest.record(
+                input_path,
+                input_hash,
+                prompt_version,
+                model_version,
+                status,
+                output_path,
+            ),
+        )
 
-    def process_and_save_code(self, code, path, compressed=False):
+    def create_budget(self):
+        return FileBudget(
+            self.max_iterations, self.max_file_tokens, self.max_file_seconds
+        )
+
+    def process_and_save_code(
+        self, code, path, compressed=False, budget=None, context=None
+    ):
         optimised_code = self.openai.process_code(
-            code, "optimise", compressed=compressed
+            code, "optimise", compressed=compressed, budget=budget, context=context
         )
         if optimised_code is None:
             self.logger.warning("Failed to optimise code. Skipping.")
             self.log_to_file(path)
             return
+        if budget is not None and budget.degraded:
+            self.logger.warning(f"Saving best effort for {path}, budget exhausted.")
+            self.log_to_file(path, "degraded_files.txt")
         self.save_code(optimised_code, path)
         return optimised_code
 
-    def read_and_process_file(self, input_path, output_path):
+    def read_and_process_file(self, input_path, output_path, budget=None, context=None):
         with open(input_path, "r", encoding="utf-8") as file:
-            return self.process_and_save_code(file.read(), output_path)
+            return self.process_and_save_code(
+                file.read(), output_path, budget=budget, context=context
+            )
+
+    def process_file(self, input_path, output_path, codebase_path=None, context=None):
+        return self.process_file_status(
+            input_path, output_path, codebase_path, context
+        )[0]
+
+    def process_file_status(
+        self, input_path, output_path, codebase_path=None, context=None
+    ):
+        token = current_file.set(input_path)
+        try:
+            with self.metrics.timer("file") as timing:
+                optimised_code, status, budget = self._process_file(
+                    input_path, output_path, codebase_path, context
+                )
+                timing["status"] = status
+                timing["tokens"] = budget.tokens if budget is not None else 0
+            return optimised_code, status
+        finally:
+            current_file.reset(token)
+
+    def _process_file(self, input_path, output_path, codebase_path=None, context=None):
+        input_hash = None
+        if self.manifest is not None:
+            input_hash = self.manifest.hash_file(input_path)
+            if self.incremental and self.manifest.is_up_to_date(
+                input_path,
+                input_hash,
+                self.openai.prompt_version(context=context),
+                self.model_version(),
+            ):
+                self.logger.info(f"Up to date, skipping: {input_path}")
+                return None, "skipped", None
 
-    def process_file(self, input_path, output_path, codebase_path=None):
         file_size = os.path.getsize(input_path)
         self.logger.info(f"Processing (size: {file_size}): {input_path}")
-        optimised_code = self.read_and_process_file(input_path, output_path)
-        if optimised_code and codebase_path is not None:
-            self.missing_imports.create(
-                input_path, output_path, codebase_path, optimised_code
+        budget = self.create_budget()
+        # Streamed code shows up in <output>.partial until the file is done
+        partial_path = f"{output_path}.partial" if self.openai.stream else None
+        token = partial_output.set(partial_path)
+        try:
+            optimised_code = self.read_and_process_file(
+                input_path, output_path, budget, context
             )
+        finally:
+            partial_output.reset(token)
+            if partial_path is not None and os.path.exists(partial_path):
+                os.remove(partial_path)
+        if optimised_code and codebase_path:
+            with self.metrics.timer("missing_imports"):
+                self.missing_imports.create(
+                    input_path, output_path, codebase_path, optimised_code
+                )
 
-    def process_directory(
+        status = "success" if optimised_code else "failed"
+        if optimised_code and budget.degraded:
+            status = "degraded"
+        self.record_manifest(input_path, input_hash, status, output_path, context)
+        return optimised_code, status, budget
+
+    def iter_files(
         self,
         input_dir_path,
         output_dir_path,
-        code_base_path=None,
         limit=None,
         allowed_extensions=["js", "jsx", "ts", "tsx"],
     ):
@@ -60,22 +211,263 @@ class CodeProcessor:
                 output_path = self.replace_input_with_output(
                     input_path, input_dir_path, output_dir_path
                 )
-                self.process_file(input_path, output_path, code_base_path)
+                yield input_path, output_path
+
+    def plan_waves(
+        self,
+        input_dir_path,
+        output_dir_path,
+        limit=None,
+        allowed_extensions=["js", "jsx", "ts", "tsx"],
+    ):
+        # Orders the files by their relative imports so that modules are
+        # optimised before the files importing them
+        with self.metrics.timer("schedule") as timing:
+            files = {
+                os.path.abspath(input_path): (input_path, output_path)
+                for input_path, output_path in self.iter_files(
+                    input_dir_path, output_dir_path, limit, allowed_extensions
+                )
+            }
+            graph = ModuleGraph(ImportIndex(input_dir_path).build())
+            for path in files:
+                graph.add_file(path)
+            dependencies = {
+                path: graph.dependencies(path) & files.keys() for path in files
+            }
+            waves = topological_waves(self.deduplicate(files, dependencies))
+            timing["files"] = len(files)
+            timing["waves"] = len(waves)
+        self.logger.info(
+            f"Scheduled {sum(map(len, waves))} of {len(files)} files "
+            f"in {len(waves)} waves"
+        )
+        return files, dependencies, waves
+
+    def deduplicate(self, files, dependencies):
+        # Returns the dependencies to schedule: duplicates are left out and
+        # follow their representative, near-duplicates wait for theirs
+        self.duplicates, self.near_duplicates = {}, {}
+        self.near_representatives = set()
+        if not self.dedup:
+            return dependencies
+        with self.metrics.timer("dedup") as timing:
+            groups = Deduplicator(self.near_duplicate_threshold).group(
+                files, self.dependency_contexts(dependencies)
+            )
+            timing["duplicates"] = sum(map(len, groups.duplicates.values()))
+            timing["near_duplicates"] = len(groups.near)
+        self.duplicates, self.near_duplicates = groups.duplicates, groups.near
+        self.near_representatives = set(groups.near.values())
+        representative = {
+            duplicate: path
+            for path, duplicates in self.duplicates.items()
+            for duplicate in duplicates
+        }
+        scheduled = {}
+        for path, imported in dependencies.items():
+            if path in representative:
+                continue
+            imported = {representative.get(other, other) for other in imported}
+            if path in self.near_duplicates:
+                imported.add(self.near_duplicates[path])
+            scheduled[path] = imported - {path}
+        self.logger.info(
+            f"{timing['duplicates']} duplicate and {timing['near_duplicates']} "
+            "near-duplicate files"
+        )
+        return scheduled
+
+    def dependency_contexts(self, dependencies):
+        # What each file's prompt will say about its imports, from the
+        # exports of the inputs: copies whose relative imports resolve to
+        # different modules are not sent the same prompt
+        signatures = {}
+        for path in set().union(*dependencies.values()):
+            with open(path, "r", encoding="utf-8", errors="replace") as file:
+                signatures[path] = export_signatures(file.read())
+        return {
+            path: dependency_context(path, imported, signatures)
+            for path, imported in dependencies.items()
+        }
+
+    def near_duplicate_context(self, path):
+        code = self.results.get(self.near_duplicates.get(path))
+        if not code:
+            return None
+        return (
+            "A near-identical file was already optimised as below. Start from "
+            "it and adapt it to the differences of this file:\n"
+            f"```\n{code}\n```"
+        )
+
+    def fan_out(
+        self,
+        path,
+        optimised_code,
+        files,
+        code_base_path=None,
+        status="success",
+        context=None,
+    ):
+        # Duplicates get the representative's result, and its status, without
+        # another API call
+        if status == "skipped":
+            # Only a representative recorded as a success is ever skipped
+            status = "success"
+        for duplicate in self.duplicates.get(path, ()):
+            input_path, output_path = files[duplicate]
+            token = current_file.set(input_path)
+            try:
+                if not optimised_code:
+                    self.logger.warning(f"Not optimised, duplicate of {path}")
+                    self.log_to_file(input_path)
+                    continue
+                self.save_code(optimised_code, output_path)
+                if status == "degraded":
+                    self.log_to_file(input_path, "degraded_files.txt")
+                if code_base_path:
+                    with self.metrics.timer("missing_imports"):
+                        self.missing_imports.create(
+                            input_path, output_path, code_base_path, optimised_code
+                        )
+                if self.manifest is not None:
+                    self.record_manifest(
+                        input_path,
+                        self.manifest.hash_file(input_path),
+                        status,
+                        output_path,
+                        context,
+                    )
+                self.signatures[duplicate] = self.signatures.get(path)
+                self.metrics.record("duplicate", of=path)
+            finally:
+                current_file.reset(token)
+
+    def process_scheduled_file(self, path, files, dependencies, code_base_path=None):
+        input_path, output_path = files[path]
+        context = [
+            dependency_context(path, dependencies[path], self.signatures),
+            self.near_duplicate_context(path),
+        ]
+        context = "\n".join(part for part in context if part) or None
+        optimised_code, status = self.process_file_status(
+            input_path, output_path, code_base_path, context
+        )
+        if optimised_code is None:
+            # Skipped files still expose the exports of their last output,
+            # without the blank lines save_code appends
+            optimised_code = self.output.read(output_path)
+            if optimised_code and optimised_code.endswith("\n\n"):
+                optimised_code = optimised_code[:-2]
+        if optimised_code:
+            self.signatures[path] = export_signatures(optimised_code)
+            if path in self.near_representatives:
+                self.results[path] = optimised_code
+        self.fan_out(path, optimised_code, files, code_base_path, status, context)
+        return optimised_code
+
+    def process_directory(
+        self,
+        input_dir_path,
+        output_dir_path,
+        code_base_path=None,
+        limit=None,
+        allowed_extensions=["js", "jsx", "ts", "tsx"],
+    ):
+        files, dependencies, waves = self.plan_waves(
+            input_dir_path, output_dir_path, limit, allowed_extensions
+        )
+        for wave in waves:
+            for path in wave:
+                self.process_scheduled_file(path, files, dependencies, code_base_path)
+        self.output.flush()
+
+    async def process_directory_async(
+        self,
+        input_dir_path,
+        output_dir_path,
+        code_base_path=None,
+        limit=None,
+        allowed_extensions=["js", "jsx", "ts", "tsx"],
+        concurrency=16,
+    ):
+        # The OpenAI helper, Prettier and import checks are blocking, so each
+        # file runs on a bounded thread pool driven from the event loop. A
+        # wave starts once every file of the previous one is done.
+        files, dependencies, waves = self.plan_waves(
+            input_dir_path, output_dir_path, limit, allowed_extensions
+        )
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for wave in waves:
+                results = await asyncio.gather(
+                    *(
+                        loop.run_in_executor(
+                            executor,
+                            self.process_scheduled_file,
+                            path,
+                            files,
+                            dependencies,
+                            code_base_path,
+                        )
+                        for path in wave
+                    ),
+                    return_exceptions=True,
+                )
+                for path, result in zip(wave, results):
+                    if isinstance(result, Exception):
+                        input_path = files[path][0]
+                        self.logger.error(f"Error processing {input_path}: {result}")
+                        self.log_to_file(input_path)
+        self.output.flush()
+
+    def count_directory_tokens(
+        self,
+        input_dir_path,
+        limit=None,
+        allowed_extensions=["js", "jsx", "ts", "tsx"],
+        max_workers=8,
+    ):
+        input_paths = [
+            input_path
+            for input_path, _ in self.iter_files(
+                input_dir_path, input_dir_path, limit, allowed_extensions
+            )
+        ]
+        with self.metrics.timer("tokens", files=len(input_paths)):
+            return self.openai.token_counter.count_files(input_paths, max_workers)
+
+    def estimate_directory(
+        self, input_dir_path, limit=None, allowed_extensions=["js", "jsx", "ts", "tsx"]
+    ):
+        # Yields (path, tokens, models, cost) for every file a run would send,
+        # without calling the API; models is None for a file too large for any
+        for input_path, _ in self.iter_files(
+            input_dir_path, input_dir_path, limit, allowed_extensions
+        ):
+            with open(input_path, "r", encoding="utf-8") as file:
+                code = file.read()
+            try:
+                tokens, models, cost = self.openai.estimate_code(code)
+            except ModelTooSmallError:
+                tokens, models, cost = self.openai.token_counter.count(code), None, None
+            yield input_path, tokens, models, cost
 
     def replace_input_with_output(self, path, input_dir_path, output_dir_path):
-        return path.replace(input_dir_path, output_dir_path)
+        # Relative to the input folder: a plain replace also rewrote any later
+        # occurrence of the folder name in the path
+        return os.path.join(output_dir_path, os.path.relpath(path, input_dir_path))
 
     def save_code(self, optimised_code, output_path):
+        with self.metrics.timer("save"):
+            self._save_code(optimised_code, output_path)
+
+    def _save_code(self, optimised_code, output_path):
         try:
             self.logger.info(f"Saving: {output_path}")
             if optimised_code is not None:
-                dir_name = os.path.dirname(output_path)
-                if not os.path.exists(dir_name):
-                    os.makedirs(dir_name)
-
-                with open(output_path, "w") as f:
-                    f.write(optimised_code)
-                    f.write("\n\n")
+                self.output.write(output_path, f"{optimised_code}\n\n")
             else:
                 self.logger.warning("Optimised code is None, nothing to save.")
         except Exception as e:
@@ -0,0 +1,104 @@
+from collections import namedtuple
+from .js_tokenizer import tokenize, NAME, STRING, TEMPLATE, PUNCT, COMMENT
+
+ImportSpecifier = namedtuple("ImportSpecifier", ["specifier", "kind", "line"])
+
+STATIC = "import"
+REEXPORT = "export"
+REQUIRE = "require"
+DYNAMIC = "dynamic"
+
+# Tokens that can appear between "import"/"export" and "from" in a clause
+# such as `import React, { useState as state } from "react"`
+_CLAUSE_PUNCT = {",", "*", "{", "}"}
+
+
+def is_relative(specifier):
+    return specifier in (".", "..") or specifier.startswith(("./", "../"))
+
+
+def _literal(token):
+    # Plain string literal, or a template literal without substitutions
+    if token.kind == STRING and len(token.value) > 1:
+        return token.value[1:-1]
+    if token.kind == TEMPLATE and "${" not in token.value and len(token.value) > 1:
+        return token.value[1:-1]
+    return None
+
+
+def _is_punct(token, value):
+    return token is not None and token.kind == PUNCT and token.value == value
+
+
+def _from_clause(tokens, position):
+    # Walks an import/export clause starting at position and returns the
+    # index of the specifier string after "from", or None
+    index = position
+    while index < len(tokens):
+        token = tokens[index]
+        if token.kind == NAME and token.value == "from":
+            following = tokens[index + 1] if index + 1 < len(tokens) else None
+            if following is not None and following.kind == STRING:
+                return index + 1
+        if token.kind == NAME or (token.kind == PUNCT and token.value in _CLAUSE_PUNCT):
+            index += 1
+            continue
+        return None
+    return None
+
+
+def scan_specifiers(source):
+    # One linear pass over the tokens; collects the specifiers of static
+    # imports, re-exports, require() calls and dynamic import() calls,
+    # whatever their layout, without building an AST
+    tokens = [token for token in tokenize(source) if token.kind != COMMENT]
+    specifiers = []
+    previous = None
+    index = 0
+    while index < len(tokens):
+        token = tokens[index]
+        following = tokens[index + 1] if index + 1 < len(tokens) else None
+        if token.kind != NAME or following is None or _is_punct(previous, "."):
+            previous = token
+            index += 1
+            continue
+
+        if token.value == "import":
+            if _is_punct(following, "(") and index + 2 < len(tokens):
+                specifier = _literal(tokens[index + 2])
+                if specifier is not None:
+                    specifiers.append(ImportSpecifier(specifier, DYNAMIC, token.line))
+            elif following.kind == STRING:
+                specifiers.append(
+                    ImportSpecifier(_literal(following), STATIC, token.line)
+                )
+                index += 1
+            else:
+                end = _from_clause(tokens, index + 1)
+                if end is not None:
+                    specifiers.append(
+                        ImportSpecifier(_literal(tokens[end]), STATIC, token.line)
+                    )
+                    index = end
+        elif token.value == "export":
+            start = index + 1
+            if following.kind == NAME and following.value == "type":
+                start += 1
+            if start < len(tokens) and (
+                _is_punct(tokens[start], "{") or _is_punct(tokens[start], "*")
+            ):
+                end = _from_clause(tokens, start)
+                if end is not None:
+                    specifiers.append(
+                        ImportSpecifier(_literal(tokens[end]), REEXPORT, token.line)
+                    )
+                    index = end
+        elif token.value == "require" and _is_punct(following, "("):
+            if index + 3 < len(tokens) and _is_punct(tokens[index + 3], ")"):
+                specifier = _literal(tokens[index + 2])
+                if specifier is not None:
+                    specifiers.append(ImportSpecifier(specifier, REQUIRE, token.line))
+
+        previous = tokens[index]
+        index += 1
+    return specifiers
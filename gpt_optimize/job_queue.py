@@ -0,0 +1,293 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+from .scheduler import export_signatures
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    input_path TEXT NOT NULL,
+    output_path TEXT NOT NULL,
+    code_base_path TEXT,
+    wave INTEGER NOT NULL DEFAULT 0,
+    dependencies TEXT NOT NULL DEFAULT '[]',
+    duplicates TEXT NOT NULL DEFAULT '[]',
+    near TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_expires REAL,
+    error TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, wave, id);
+"""
+
+
+class JobQueue:
+    # Files to process, shared through a sqlite database by any number of
+    # worker processes. A worker leases a job and keeps the lease alive with
+    # heartbeats; the lease of a worker that died expires and the job goes
+    # back to the queue.
+    def __init__(self, path, lease_seconds=600, max_attempts=3):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            path, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(_SCHEMA)
+
+    def _transaction(self, callback):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers can
+        # never claim the same job
+        with self._lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = callback(self.connection)
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+            return result
+
+    def enqueue(self, jobs, reset=False):
+        # Already known files keep their state unless reset is set, so
+        # enqueueing again after a crash only adds what is new
+        conflict = (
+            "UPDATE SET status = 'pending', attempts = 0, worker = NULL, "
+            "lease_expires = NULL, error = NULL, input_path = excluded.input_path, "
+            "output_path = excluded.output_path, "
+            "code_base_path = excluded.code_base_path, wave = excluded.wave, "
+            "dependencies = excluded.dependencies, "
+            "duplicates = excluded.duplicates, near = excluded.near, "
+            "updated = excluded.updated"
+            if reset
+            else "NOTHING"
+        )
+        rows = [
+            (
+                job["path"],
+                job["input_path"],
+                job["output_path"],
+                job.get("code_base_path"),
+                job.get("wave", 0),
+                json.dumps(job.get("dependencies", [])),
+                json.dumps(job.get("duplicates", [])),
+                json.dumps(job["near"]) if job.get("near") else None,
+                time.time(),
+            )
+            for job in jobs
+        ]
+        return self._transaction(
+            lambda connection: connection.executemany(
+                "INSERT INTO jobs (path, input_path, output_path, code_base_path, "
+                "wave, dependencies, duplicates, near, updated) "
+                f"VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(path) DO {conflict}",
+                rows,
+            ).rowcount
+        )
+
+    def _expire_leases(self, connection, now):
+        connection.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' "
+            "ELSE 'pending' END, worker = NULL, lease_expires = NULL, "
+            "error = 'lease expired', updated = ? "
+            "WHERE status = 'leased' AND lease_expires < ?",
+            (self.max_attempts, now, now),
+        )
+
+    def claim(self, worker_id):
+        def claim_job(connection):
+            now = time.time()
+            self._expire_leases(connection, now)
+            # A job waits until every job of the earlier waves is finished
+            row = connection.execute(
+                "SELECT * FROM jobs WHERE status = 'pending' AND wave <= "
+                "(SELECT MIN(wave) FROM jobs WHERE status IN ('pending', 'leased')) "
+                "ORDER BY wave, id LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE jobs SET status = 'leased', worker = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated = ? WHERE id = ?",
+                (worker_id, now + self.lease_seconds, now, row["id"]),
+            )
+            return dict(row)
+
+        return self._transaction(claim_job)
+
+    def heartbeat(self, job_id, worker_id):
+        # False once the lease was lost, e.g. after a long pause
+        now = time.time()
+        return self._transaction(
+            lambda connection: connection.execute(
+                "UPDATE jobs SET lease_expires = ?, updated = ? "
+                "WHERE id = ? AND worker = ? AND status = 'leased'",
+                (now + self.lease_seconds, now, job_id, worker_id),
+            ).rowcount
+            == 1
+        )
+
+    def complete(self, job_id, worker_id, status, error=None):
+        return self._transaction(
+            lambda connection: connection.execute(
+                "UPDATE jobs SET status = ?, error = ?, lease_expires = NULL, "
+                "updated = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                (status, error, time.time(), job_id, worker_id),
+            ).rowcount
+            == 1
+        )
+
+    def counts(self):
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+            ).fetchall()
+        return {status: count for status, count in rows}
+
+    def unfinished(self):
+        counts = self.counts()
+        return counts.get(PENDING, 0) + counts.get(LEASED, 0)
+
+    def close(self):
+        self.connection.close()
+
+
+def enqueue_directory(
+    processor,
+    queue,
+    input_dir_path,
+    output_dir_path,
+    code_base_path=None,
+    limit=None,
+    reset=False,
+):
+    # The same waves, dependencies and duplicate groups as an in-process run,
+    # written down so that other processes can pick them up
+    files, dependencies, waves = processor.plan_waves(
+        input_dir_path, output_dir_path, limit
+    )
+    jobs = []
+    for wave_index, wave in enumerate(waves):
+        for path in wave:
+            input_path, output_path = files[path]
+            near = processor.near_duplicates.get(path)
+            jobs.append(
+                {
+                    "path": path,
+                    "input_path": input_path,
+                    "output_path": output_path,
+                    "code_base_path": code_base_path,
+                    "wave": wave_index,
+                    "dependencies": [
+                        [dependency, *files[dependency]]
+                        for dependency in sorted(dependencies[path])
+                    ],
+                    "duplicates": [
+                        [duplicate, *files[duplicate]]
+                        for duplicate in processor.duplicates.get(path, ())
+                    ],
+                    "near": [near, *files[near]] if near else None,
+                }
+            )
+    return queue.enqueue(jobs, reset)
+
+
+class Worker:
+    def __init__(
+        self, processor, queue, worker_id=None, heartbeat_seconds=30, poll_seconds=2
+    ):
+        self.processor = processor
+        self.queue = queue
+        self.logger = processor.logger
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.heartbeat_seconds = heartbeat_seconds
+        self.poll_seconds = poll_seconds
+
+    def _read_output(self, output_path):
+        return self.processor.output.read(output_path)
+
+    def _prepare(self, job):
+        # Rebuilds the state process_scheduled_file expects from the job and
+        # the outputs the other workers already wrote
+        processor = self.processor
+        path = job["path"]
+        files = {path: (job["input_path"], job["output_path"])}
+        dependencies = {path: set()}
+        for dependency, input_path, output_path in json.loads(job["dependencies"]):
+            files[dependency] = (input_path, output_path)
+            dependencies[path].add(dependency)
+            code = self._read_output(output_path)
+            if code:
+                processor.signatures[dependency] = export_signatures(code)
+        duplicates = json.loads(job["duplicates"])
+        for duplicate, input_path, output_path in duplicates:
+            files[duplicate] = (input_path, output_path)
+        processor.duplicates = {path: [duplicate[0] for duplicate in duplicates]}
+        processor.near_duplicates, processor.near_representatives = {}, set()
+        if job["near"]:
+            near, _, near_output_path = json.loads(job["near"])
+            processor.near_duplicates = {path: near}
+            processor.results[near] = self._read_output(near_output_path)
+        return files, dependencies
+
+    def _heartbeat(self, job_id, stop):
+        while not stop.wait(self.heartbeat_seconds):
+            if not self.queue.heartbeat(job_id, self.worker_id):
+                self.logger.warning(f"Lost the lease of job {job_id}")
+                return
+
+    def process(self, job):
+        stop = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(job["id"], stop), daemon=True
+        )
+        heartbeat.start()
+        try:
+            files, dependencies = self._prepare(job)
+            optimised_code = self.processor.process_scheduled_file(
+                job["path"], files, dependencies, job["code_base_path"]
+            )
+            status, error = (
+                (DONE, None) if optimised_code else (FAILED, "not optimised")
+            )
+        except Exception as e:
+            self.logger.error(f"Error processing {job['input_path']}: {e}")
+            self.processor.log_to_file(job["input_path"])
+            status, error = FAILED, str(e)
+        finally:
+            # Other workers read this output for the files importing it
+            self.processor.output.flush()
+            stop.set()
+            heartbeat.join()
+        if not self.queue.complete(job["id"], self.worker_id, status, error):
+            self.logger.warning(f"Job {job['id']} was taken over, result not recorded")
+        return status
+
+    def run(self, max_jobs=None):
+        processed = 0
+        while max_jobs is None or processed < max_jobs:
+            job = self.queue.claim(self.worker_id)
+            if job is None:
+                # Jobs of a later wave may still be waiting for other workers
+                if not self.queue.unfinished():
+                    break
+                time.sleep(self.poll_seconds)
+                continue
+            self.logger.info(f"{self.worker_id} processing {job['input_path']}")
+            self.process(job)
+            processed += 1
+        return processed
@@ -0,0 +1,177 @@
+from collections import namedtuple
+
+Token = namedtuple("Token", ["kind", "value", "start", "end", "line"])
+
+NAME = "name"
+STRING = "string"
+TEMPLATE = "template"
+REGEX = "regex"
+NUMBER = "number"
+PUNCT = "punct"
+COMMENT = "comment"
+
+# Tokens after which a "/" starts a regular expression rather than a division
+_REGEX_PREFIX_PUNCT = set("(,=:[!&|?{};+-*%~^")
+_REGEX_PREFIX_NAMES = {
+    "return",
+    "typeof",
+    "case",
+    "do",
+    "else",
+    "in",
+    "of",
+    "new",
+    "delete",
+    "void",
+    "throw",
+    "yield",
+    "await",
+}
+
+
+def _is_name_char(char):
+    return char.isalnum() or char in "_$"
+
+
+def tokenize(source):
+    # A single linear pass over the source. It understands just enough of the
+    # grammar (strings, template literals, comments, regexes) to tell code
+    # apart from text; it does not build an AST.
+    tokens = []
+    length = len(source)
+    index = 0
+    line = 1
+    brace_depth = 0
+    template_stack = []
+    previous = None
+
+    def add(kind, start, end, start_line):
+        token = Token(kind, source[start:end], start, end, start_line)
+        tokens.append(token)
+        return token
+
+    def scan_template(start):
+        # Scans from just after a backtick or a "}" closing a ${} expression
+        # up to the closing backtick or the next "${".
+        nonlocal line
+        index = start
+        while index < length:
+            char = source[index]
+            if char == "\\":
+                line += source.startswith("\n", index + 1)
+                index += 2
+                continue
+            if char == "\n":
+                line += 1
+            elif char == "`":
+                return index + 1, False
+            elif char == "$" and source.startswith("{", index + 1):
+                return index + 2, True
+            index += 1
+        return length, False
+
+    while index < length:
+        char = source[index]
+        start_line = line
+
+        if char == "\n":
+            line += 1
+            index += 1
+            continue
+        if char.isspace():
+            index += 1
+            continue
+
+        if source.startswith("//", index):
+            end = source.find("\n", index)
+            end = length if end == -1 else end
+            add(COMMENT, index, end, start_line)
+            index = end
+            continue
+        if source.startswith("/*", index):
+            end = source.find("*/", index + 2)
+            end = length if end == -1 else end + 2
+            line += source.count("\n", index, end)
+            add(COMMENT, index, end, start_line)
+            index = end
+            continue
+
+        if char in "'\"":
+            end = index + 1
+            while end < length and source[end] != char:
+                if source[end] == "\\":
+                    end += 1
+                    line += source.startswith("\n", end)
+                elif source[end] == "\n":
+                    # Unterminated, most likely an apostrophe in JSX text
+                    end -= 1
+                    break
+                end += 1
+            end = min(end + 1, length)
+            previous = add(STRING, index, end, start_line)
+            index = end
+            continue
+
+        if char == "`":
+            end, opens_expression = scan_template(index + 1)
+            previous = add(TEMPLATE, index, end, start_line)
+            if opens_expression:
+                template_stack.append(brace_depth)
+                brace_depth += 1
+            index = end
+            continue
+
+        if char == "}" and template_stack and template_stack[-1] == brace_depth - 1:
+            template_stack.pop()
+            brace_depth -= 1
+            end, opens_expression = scan_template(index + 1)
+            previous = add(TEMPLATE, index, end, start_line)
+            if opens_expression:
+                template_stack.append(brace_depth)
+                brace_depth += 1
+            index = end
+            continue
+
+        if char == "/" and (
+            previous is None
+            or (previous.kind == PUNCT and previous.value in _REGEX_PREFIX_PUNCT)
+            or (previous.kind == NAME and previous.value in _REGEX_PREFIX_NAMES)
+        ):
+            end = index + 1
+            in_class = False
+            while end < length and source[end] != "\n":
+                if source[end] == "\\":
+                    end += 2
+                    continue
+                if source[end] == "[":
+                    in_class = True
+                elif source[end] == "]":
+                    in_class = False
+                elif source[end] == "/" and not in_class:
+                    break
+                end += 1
+            if end < length and source[end] == "/":
+                end += 1
+                while end < length and _is_name_char(source[end]):
+                    end += 1
+                previous = add(REGEX, index, end, start_line)
+                index = end
+                continue
+
+        if _is_name_char(char):
+            end = index + 1
+            while end < length and _is_name_char(source[end]):
+                end += 1
+            kind = NUMBER if char.isdigit() else NAME
+            previous = add(kind, index, end, start_line)
+            index = end
+            continue
+
+        if char == "{":
+            brace_depth += 1
+        elif char == "}":
+            brace_depth -= 1
+        previous = add(PUNCT, index, index + 1, start_line)
+        index += 1
+
+    return tokens
@@ -1,11 +1,32 @@
+import os
+import json
 import subprocess
 import logging
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 
 
-class JsValidator:
-    def __init__(self, file_path, error_file_path="errors.txt"):
-        self.file_path = file_path
-        self.error_file_path = error_file_path
+class PrettierWorkerError(Exception):
+    pass
+
+
+class PrettierWorker:
+    script_path = os.path.join(os.path.dirname(__file__), "prettier_worker.js")
+
+    def __init__(self, logger=None, max_restarts=3, metrics=None, timeout=30):
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.metrics = metrics
+        self.max_restarts = max_restarts
+        # Seconds a single source may take before the worker is killed
+        self.timeout = timeout
+        self.restarts = 0
+        self.process = None
+        self._pending = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._installed = False
+        # Set once the worker gave up, every later format fails at once
+        self.failure = None
 
     def install_prettier(self):
         try:
@@ -15,30 +36,189 @@ class JsValidator:
                 text=True,
                 capture_output=True,
             )
-        except subprocess.CalledProcessError as e:
-            logging.warning(f"Could not install Prettier. Error: {str(e)}")
-            logging.info(e.stdout)
+        except (OSError, subprocess.CalledProcessError) as e:
+            self.logger.warning(f"Could not install Prettier. Error: {str(e)}")
+            if getattr(e, "stdout", None):
+                self.logger.info(e.stdout)
             return False
         return True
 
-    def format(self):
-        # Attempt to format the file
+    @staticmethod
+    def _global_node_path():
         try:
             result = subprocess.run(
-                ["prettier", "--write", "--parser", "babel", self.file_path],
-                check=True,
-                text=True,
-                capture_output=True,
-            )
-            logging.debug(result.stdout)
-            return True
-        except subprocess.CalledProcessError as e:
-            # If Prettier is not found, try to install it
-            if "command not found" in str(e):
-                if self.install_prettier():
-                    return self.format()
-            logging.warning(
-                f"Prettier found issues in {self.file_path}. Error: {str(e)}"
+                ["npm", "root", "--global"], check=True, text=True, capture_output=True
             )
-            logging.warning(e.stderr)  # log the actual prettier error
-            return e.stderr
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        return result.stdout.strip()
+
+    def _start(self):
+        env = dict(os.environ)
+        node_path = [env.get("NODE_PATH"), self._global_node_path()]
+        env["NODE_PATH"] = os.pathsep.join(path for path in node_path if path)
+        self.process = subprocess.Popen(
+            ["node", self.script_path],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            env=env,
+        )
+        threading.Thread(
+            target=self._read_responses, args=(self.process,), daemon=True
+        ).start()
+        self.logger.debug(f"Started Prettier worker (pid {self.process.pid})")
+
+    def _read_responses(self, process):
+        error = "Prettier worker exited"
+        for line in process.stdout:
+            try:
+                response = json.loads(line)
+            except ValueError:
+                # Stray output (a warning printed by a plugin, ...) must not
+                # kill the reader and leave every request hanging
+                self.logger.warning(f"Unexpected Prettier output: {line[:200]!r}")
+                continue
+            if not isinstance(response, dict) or "id" not in response:
+                continue
+            if response["id"] is None:
+                error = response["error"]
+                break
+            with self._lock:
+                future = self._pending.pop(response["id"], None)
+                self.restarts = 0
+            if future is not None:
+                future.set_result(response)
+
+        # The process died: fail whatever it still owed us
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self.process is process:
+                self.process = None
+        for future in pending.values():
+            future.set_exception(PrettierWorkerError(error))
+
+    def _submit(self, sources, parser):
+        futures = []
+        with self._lock:
+            if self.process is None:
+                try:
+                    self._start()
+                except OSError as e:
+                    # No Node: restarting cannot help
+                    self.failure = f"Cannot start the Prettier worker: {e}"
+                    raise PrettierWorkerError(self.failure)
+            try:
+                for source in sources:
+                    self._next_id += 1
+                    future = Future()
+                    self._pending[self._next_id] = future
+                    futures.append(future)
+                    request = {"id": self._next_id, "source": source, "parser": parser}
+                    self.process.stdin.write(json.dumps(request) + "\n")
+                self.process.stdin.flush()
+            except (OSError, ValueError) as e:
+                self.process.kill()
+                self.process = None
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(PrettierWorkerError(str(e)))
+        return futures
+
+    def _kill(self):
+        # The reader of the killed process fails whatever it still owed us
+        with self._lock:
+            process, self.process = self.process, None
+        if process is not None:
+            process.kill()
+
+    def format_many(self, sources, parser="babel"):
+        if self.metrics is None:
+            return self._format_many(sources, parser)
+        with self.metrics.timer("prettier", sources=len(sources)):
+            return self._format_many(sources, parser)
+
+    def _format_many(self, sources, parser):
+        # Returns a (valid, formatted code or error message) pair per source
+        # The worker answers in order, so a source that hangs or crashes it is
+        # the first one still unanswered
+        if self.failure is not None:
+            raise PrettierWorkerError(self.failure)
+        results = [None] * len(sources)
+        remaining = list(range(len(sources)))
+        crashes = {}
+        while remaining:
+            futures = self._submit([sources[index] for index in remaining], parser)
+            failed = []
+            timed_out = False
+            for index, future in zip(remaining, futures):
+                try:
+                    response = future.result(timeout=self.timeout)
+                except FutureTimeoutError:
+                    timed_out = True
+                    results[index] = (
+                        False,
+                        f"Prettier timed out after {self.timeout}s",
+                    )
+                    self._kill()
+                    continue
+                except PrettierWorkerError as e:
+                    failed.append(index)
+                    error = str(e)
+                    continue
+                if response["ok"]:
+                    results[index] = (True, response["formatted"])
+                else:
+                    results[index] = (False, response["error"])
+            if failed and not timed_out:
+                head = failed[0]
+                if not error.startswith("Cannot load prettier"):
+                    crashes[head] = crashes.get(head, 0) + 1
+                    if crashes[head] >= 2:
+                        # It took the worker down twice: the code is at fault,
+                        # not the worker
+                        results[head] = (
+                            False,
+                            f"Prettier crashed on this code: {error}",
+                        )
+                        failed = failed[1:]
+                if failed:
+                    self._handle_crash(error)
+            remaining = failed
+        return results
+
+    def format(self, source, parser="babel"):
+        return self.format_many([source], parser)[0]
+
+    def _handle_crash(self, error):
+        # The next submission starts a fresh process; give up after too many
+        # crashes in a row
+        with self._lock:
+            if self.restarts >= self.max_restarts:
+                self.failure = f"Prettier worker keeps failing, giving up: {error}"
+                raise PrettierWorkerError(self.failure)
+            self.restarts += 1
+        self.logger.warning(f"Restarting Prettier worker after error: {error}")
+        if "Cannot load prettier" in error and not self._installed:
+            self._installed = True
+            self.install_prettier()
+
+    def check(self):
+        # Formats an empty module, so a missing Node or Prettier is reported
+        # before any API call is paid for; returns the error or None
+        try:
+            valid, error = self.format("")
+        except PrettierWorkerError as e:
+            return str(e)
+        return None if valid else error
+
+    def close(self):
+        with self._lock:
+            process, self.process = self.process, None
+        if process is not None:
+            try:
+                process.stdin.close()
+                process.wait(timeout=self.timeout)
+            except (OSError, subprocess.TimeoutExpired):
+                process.kill()
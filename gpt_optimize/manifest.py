@@ -0,0 +1,68 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+
+class Manifest:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.records = self._load()
+
+    @staticmethod
+    def path_for(output_dir_path):
+        # The manifest sits next to the output dir, e.g. output.manifest.jsonl
+        output_dir_path = os.path.abspath(output_dir_path)
+        return os.path.join(
+            os.path.dirname(output_dir_path),
+            f"{os.path.basename(output_dir_path)}.manifest.jsonl",
+        )
+
+    @staticmethod
+    def hash_file(path):
+        with open(path, "rb") as file:
+            return hashlib.sha256(file.read()).hexdigest()
+
+    def _load(self):
+        records = {}
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A run interrupted mid-write can leave a truncated last line
+                    continue
+                records[record["input"]] = record
+        return records
+
+    def is_up_to_date(self, input_path, input_hash, prompt_version, model):
+        record = self.records.get(os.path.normpath(input_path))
+        return (
+            record is not None
+            and record["status"] == "success"
+            and record["hash"] == input_hash
+            and record["prompt_version"] == prompt_version
+            and record["model"] == model
+            and os.path.exists(record["output"])
+        )
+
+    def record(
+        self, input_path, input_hash, prompt_version, model, status, output_path
+    ):
+        record = {
+            "input": os.path.normpath(input_path),
+            "output": output_path,
+            "hash": input_hash,
+            "prompt_version": prompt_version,
+            "model": model,
+            "status": status,
+            "time": time.time(),
+        }
+        with self._lock:
+            self.records[record["input"]] = record
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(record) + "\n")
@@ -0,0 +1,127 @@
+import json
+import math
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import defaultdict
+
+# The file currently being processed, so events recorded deep inside the
+# helpers are attributed to it
+current_file = contextvars.ContextVar("current_file", default=None)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+
+class Metrics:
+    def __init__(self, path=None):
+        self.path = path
+        self.events = []
+        self._lock = threading.Lock()
+
+    def record(self, stage, latency=None, **fields):
+        event = {
+            "time": time.time(),
+            "file": current_file.get(),
+            "stage": stage,
+            "latency": latency,
+            **fields,
+        }
+        with self._lock:
+            self.events.append(event)
+            if self.path is not None:
+                with open(self.path, "a", encoding="utf-8") as file:
+                    file.write(json.dumps(event) + "\n")
+
+    @contextmanager
+    def timer(self, stage, **fields):
+        # Callers can add fields known only at the end (tokens, status, ...)
+        # to the yielded dict
+        extra = {}
+        started_at = time.perf_counter()
+        try:
+            yield extra
+        finally:
+            self.record(stage, time.perf_counter() - started_at, **fields, **extra)
+
+    def summary(self, slowest=5):
+        with self._lock:
+            events = list(self.events)
+
+        latencies = defaultdict(list)
+        counts = defaultdict(int)
+        file_tokens = defaultdict(int)
+        file_latencies = {}
+        tokens_saved = 0
+        cost = 0
+        for event in events:
+            counts[event["stage"]] += 1
+            if event["latency"] is not None:
+                latencies[event["stage"]].append(event["latency"])
+            if event["stage"] == "api_call" and event["file"] is not None:
+                file_tokens[event["file"]] += event.get("prompt_tokens", 0)
+                file_tokens[event["file"]] += event.get("completion_tokens", 0)
+            if event["stage"] == "api_call":
+                cost += event.get("cost") or 0
+            if event["stage"] == "compaction":
+                tokens_saved += event.get("tokens_saved", 0)
+            if event["stage"] == "file":
+                file_latencies[event["file"]] = event["latency"]
+
+        stages = {
+            stage: {
+                "count": counts[stage],
+                "total": sum(values),
+                "p50": percentile(values, 0.5),
+                "p95": percentile(values, 0.95),
+            }
+            for stage, values in latencies.items()
+        }
+        for stage in counts:
+            stages.setdefault(stage, {"count": counts[stage]})
+
+        tokens = list(file_tokens.values())
+        return {
+            "stages": stages,
+            "files": len(file_latencies),
+            "total_tokens": sum(tokens),
+            "tokens_saved": tokens_saved,
+            "cost": cost,
+            "tokens_per_file": {
+                "mean": sum(tokens) / len(tokens) if tokens else None,
+                "p50": percentile(tokens, 0.5),
+                "p95": percentile(tokens, 0.95),
+            },
+            "slowest_files": sorted(
+                file_latencies.items(), key=lambda item: item[1], reverse=True
+            )[:slowest],
+        }
+
+    def format_summary(self, slowest=5):
+        summary = self.summary(slowest)
+        lines = [
+            f"Files: {summary['files']}, total tokens: {summary['total_tokens']}, "
+            f"cost: ${summary['cost']:.4f}",
+            f"Tokens per file: mean {summary['tokens_per_file']['mean']}, "
+            f"p50 {summary['tokens_per_file']['p50']}, "
+            f"p95 {summary['tokens_per_file']['p95']}",
+            f"Tokens saved by compaction: {summary['tokens_saved']}",
+        ]
+        for stage, stats in sorted(summary["stages"].items()):
+            if "p50" in stats:
+                lines.append(
+                    f"{stage}: {stats['count']} calls, p50 {stats['p50']:.3f}s, "
+                    f"p95 {stats['p95']:.3f}s, total {stats['total']:.3f}s"
+                )
+            else:
+                lines.append(f"{stage}: {stats['count']}")
+        lines.append("Slowest files:")
+        lines.extend(
+            f"  {latency:.3f}s {path}" for path, latency in summary["slowest_files"]
+        )
+        return "\n".join(lines)
@@ -1,80 +1,116 @@
 import os
-import re
+import json
 import logging
-from pathlib import Path
-
-# Define a logger
-logger = logging.getLogger(__name__)
-handler = logging.StreamHandler()
-formatter = logging.Formatter("%(asctime)s %(name)-12s %(levelname)-8s %(message)s")
-handler.setFormatter(formatter)
-logger.addHandler(handler)
-logger.setLevel(logging.DEBUG)
+import threading
+from .import_index import ImportIndex
+from .import_scanner import scan_specifiers, is_relative
+from .module_graph import ModuleGraph
 
 
 class MissingImport:
-    def __init__(self, logger=None):
+    def __init__(self, logger=None, index_path=None):
         self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.index_path = index_path
+        self.indexes = {}
+        self.graphs = {}
+        self.optimised_files = set()
+        self._index_lock = threading.Lock()
 
-    def detect_relative_imports(self, js_code):
-        # Regular expression pattern to match relative import statements
-        pattern = re.compile(r'import .* from [\'"](.*?)[\'"];', re.MULTILINE)
+    def _get_index(self, code_base_path):
+        # One index per codebase, built (or loaded and refreshed) on first use
+        root = os.path.abspath(code_base_path)
+        with self._index_lock:
+            index = self.indexes.get(root)
+            if index is None:
+                if self.index_path and os.path.exists(self.index_path):
+                    index = ImportIndex.load(self.index_path, root)
+                else:
+                    index = ImportIndex(root).build()
+                self.logger.info(f"Indexed {len(index.dirs)} directories under {root}")
+                self.indexes[root] = index
+        return index
+
+    def save_index(self):
+        if not self.index_path:
+            return
+        with self._index_lock:
+            indexes = list(self.indexes.values())
+        # The persisted file holds a single codebase, the one used last
+        if indexes:
+            indexes[-1].save(self.index_path)
 
-        matches = pattern.findall(js_code)
+    def get_graph(self, code_base_path):
+        # The dependency graph of the whole codebase, built on first use
+        root = os.path.abspath(code_base_path)
+        index = self._get_index(code_base_path)
+        with self._index_lock:
+            graph = self.graphs.get(root)
+            if graph is None:
+                graph = ModuleGraph.build(index)
+                self.logger.info(
+                    f"Import graph of {root}: {len(graph.edges)} files, "
+                    f"{len(graph.missing_edges())} unresolved imports"
+                )
+                self.graphs[root] = graph
+        return graph
 
-        # Filter and display only the relative import paths
-        relative_imports = [
-            m for m in matches if m.startswith("./") or m.startswith("../")
+    def detect_relative_imports(self, js_code):
+        return [
+            found.specifier
+            for found in scan_specifiers(js_code)
+            if is_relative(found.specifier)
         ]
-        return relative_imports
 
-    def verify_relative_imports(self, input_path, relative_imports, code_base_path):
+    def verify_relative_imports(self, input_path, optimised_code, code_base_path):
         # Remove 'input' from input_path
         self.logger.debug("input_path %s", input_path)
         abs_input_path = input_path.replace("input", code_base_path)
+        graph = self.get_graph(code_base_path)
 
         # Test if file exists
-        file = Path(abs_input_path)
-        if not file.is_file():
+        if not graph.index.is_file(abs_input_path):
             self.logger.warning("File does not exist: %s", abs_input_path)
-            return
+            return []
 
-        # Now check relative imports
-        for rel_path in relative_imports:
-            self.logger.debug("rel_path %s", rel_path)
-            dirname = os.path.dirname(abs_input_path)
-            self.logger.debug("dirname %s", dirname)
-            raw_path = os.path.join(dirname, rel_path)
-            self.logger.debug("raw_path %s", raw_path)
-            abs_path = os.path.normpath(
-                raw_path
-            )  # Generate absolute path based on the relative import
-
-            import_file = self._get_first_matching_file(abs_path)
-            if import_file:
-                self.logger.info("File exists: %s", import_file)
-            else:
-                self.logger.error("File does not exist: %s", abs_path)
-                self._write_to_missing_imports(abs_path)
-
-    def _get_first_matching_file(self, abs_path):
-        for ext in ["*", ".js", ".jsx", ".ts", ".tsx"]:
-            matches = list(Path(abs_path).parent.glob(Path(abs_path).name + ext))
-            if matches:
-                return matches[0]
-
-    def _write_to_missing_imports(self, abs_path):
-        with open("missing_imports.txt", "a+", encoding="utf-8") as file:
-            file.write(f"{abs_path} \n\n")
+        # The optimised code replaces the file's edges in the codebase graph
+        dependencies, missing = graph.add_file(abs_input_path, optimised_code)
+        with self._index_lock:
+            self.optimised_files.add(os.path.abspath(abs_input_path))
+        self.logger.debug("dependencies %s", dependencies)
+        for edge in missing:
+            self.logger.error(
+                f"Import {edge.specifier!r} ({edge.kind}, line {edge.line}) "
+                f"does not resolve: {edge.target}"
+            )
+        return missing
 
     def create(self, input_path, output_path, code_base_path, optimised_code):
         self.logger.debug("output_path %s", output_path)
-        relative_imports = self.detect_relative_imports(optimised_code)
-        self.logger.debug("relative_imports %s", relative_imports)
-        self.verify_relative_imports(input_path, relative_imports, code_base_path)
+        return self.verify_relative_imports(input_path, optimised_code, code_base_path)
+
+    def write_report(self, report_path, graph_path=None):
+        # One JSON line per unresolved import across the codebase; "optimised"
+        # tells the ones introduced by this run's output apart
+        with self._index_lock:
+            graphs = list(self.graphs.values())
+            optimised_files = set(self.optimised_files)
+        if not graphs:
+            return
+        with open(report_path, "w", encoding="utf-8") as file:
+            for graph in graphs:
+                for edge in graph.missing_edges():
+                    record = {
+                        **edge._asdict(),
+                        "optimised": edge.file in optimised_files,
+                    }
+                    file.write(json.dumps(record) + "\n")
+        if graph_path:
+            # The persisted graph holds a single codebase, the one used last
+            graphs[-1].save(graph_path)
 
 
 if __name__ == "__main__":
-    mi = MissingImport(logger)
+    logging.basicConfig(level=logging.DEBUG)
+    mi = MissingImport()
     # Insert the appropriate values for the parameters in the create method.
     mi.create("input_path", "output_path", "code_base_path", "optimised_code")
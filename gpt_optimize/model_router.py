@@ -0,0 +1,214 @@
+import json
+import time
+import hashlib
+import threading
+
+# Context window, largest completion, dollars per 1k prompt and completion
+# tokens, and latency: seconds before the first token plus seconds per 1k
+# completion tokens
+DEFAULT_MODELS = {
+    "gpt-3.5-turbo-0613": {
+        "context": 4096,
+        "max_output": 4096,
+        "input_price": 0.0015,
+        "output_price": 0.002,
+        "base_seconds": 0.5,
+        "seconds_per_1k": 15,
+    },
+    "gpt-3.5-turbo-16k": {
+        "context": 16384,
+        "max_output": 16384,
+        "input_price": 0.003,
+        "output_price": 0.004,
+        "base_seconds": 0.7,
+        "seconds_per_1k": 15,
+    },
+    "gpt-4": {
+        "context": 8192,
+        "max_output": 8192,
+        "input_price": 0.03,
+        "output_price": 0.06,
+        "base_seconds": 1.0,
+        "seconds_per_1k": 50,
+    },
+}
+
+# Models each operation may use, and the completion expected for it:
+# output_ratio times the prompt plus output_tokens
+DEFAULT_OPERATIONS = {
+    "optimise": {
+        "models": ["gpt-3.5-turbo-0613", "gpt-3.5-turbo-16k"],
+        "output_ratio": 1.0,
+        "output_tokens": 0,
+    },
+    "generate_test": {
+        "models": ["gpt-3.5-turbo-0613", "gpt-3.5-turbo-16k"],
+        "output_ratio": 1.5,
+        "output_tokens": 0,
+    },
+    # A verdict and a short list of points
+    "validate": {
+        "models": ["gpt-3.5-turbo-0613", "gpt-3.5-turbo-16k"],
+        "output_ratio": 0,
+        "output_tokens": 300,
+    },
+}
+
+
+class ModelTooSmallError(Exception):
+    pass
+
+
+class ModelRouter:
+    # Picks the model of every call. Among the models allowed for the
+    # operation, those whose context holds the prompt and the expected
+    # completion (so no continuation rounds are needed) compete on expected
+    # cost and latency, made worse by their observed failure rate.
+    def __init__(
+        self,
+        models=None,
+        operations=None,
+        latency_weight=0.0001,
+        max_failure_rate=0.5,
+        min_calls=5,
+        failure_half_life=300,
+    ):
+        self.models = {name: dict(spec) for name, spec in DEFAULT_MODELS.items()}
+        for name, spec in (models or {}).items():
+            self.models.setdefault(name, {}).update(spec)
+        self.operations = {
+            name: dict(spec) for name, spec in DEFAULT_OPERATIONS.items()
+        }
+        for name, spec in (operations or {}).items():
+            self.operations.setdefault(name, {}).update(spec)
+        # Dollars one second of latency is worth
+        self.latency_weight = latency_weight
+        self.max_failure_rate = max_failure_rate
+        self.min_calls = min_calls
+        # Seconds after which a call weighs half as much in the failure rate,
+        # so a model left out after a bad stretch is tried again later
+        self.failure_half_life = failure_half_life
+        # model -> [decayed calls, decayed failures, time of the last update]
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        # JSON with optional "models", "operations", "latency_weight",
+        # "max_failure_rate" and "min_calls", merged into the built-in tables
+        with open(path, "r", encoding="utf-8") as file:
+            return cls(**json.load(file))
+
+    def version(self):
+        # Changes whenever the tables do, so the manifest can tell
+        payload = json.dumps([self.models, self.operations], sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:12]
+
+    def _operation(self, operation):
+        return self.operations.get(operation, self.operations["optimise"])
+
+    def expected_output(self, operation, prompt_tokens, model=None):
+        spec = self._operation(operation)
+        tokens = int(
+            prompt_tokens * spec.get("output_ratio", 1.0) + spec.get("output_tokens", 0)
+        )
+        if model is not None:
+            # A pinned model missing from the tables has no known limit
+            tokens = min(tokens, self.models.get(model, {}).get("max_output", tokens))
+        return tokens
+
+    def cost(self, model, prompt_tokens, completion_tokens):
+        spec = self.models.get(model)
+        if spec is None:
+            return None
+        return (
+            prompt_tokens * spec.get("input_price", 0)
+            + completion_tokens * spec.get("output_price", 0)
+        ) / 1000
+
+    def latency(self, model, completion_tokens):
+        spec = self.models[model]
+        return (
+            spec.get("base_seconds", 0)
+            + completion_tokens * spec.get("seconds_per_1k", 0) / 1000
+        )
+
+    def _decayed(self, model, now):
+        calls, failures, updated = self._stats.get(model, (0.0, 0.0, now))
+        weight = 0.5 ** ((now - updated) / self.failure_half_life)
+        return calls * weight, failures * weight
+
+    def failure_rate(self, model):
+        with self._lock:
+            calls, failures = self._decayed(model, time.monotonic())
+        if calls < self.min_calls:
+            return 0.0
+        return failures / calls
+
+    def record(self, model, failed):
+        now = time.monotonic()
+        with self._lock:
+            calls, failures = self._decayed(model, now)
+            self._stats[model] = [calls + 1, failures + (1 if failed else 0), now]
+
+    def fits(self, model, operation, prompt_tokens):
+        spec = self.models.get(model)
+        if spec is None:
+            # Unknown model: trust the caller
+            return True
+        output = self.expected_output(operation, prompt_tokens, model)
+        return prompt_tokens + output <= spec["context"]
+
+    def fits_any(self, operation, prompt_tokens, model=None):
+        # Whether choose finds a model holding the prompt and the whole
+        # completion, without continuation rounds
+        if model is not None and self.fits(model, operation, prompt_tokens):
+            return True
+        return any(
+            self.fits(name, operation, prompt_tokens)
+            for name in self._operation(operation)["models"]
+            if name in self.models
+        )
+
+    def score(self, model, operation, prompt_tokens):
+        output = self.expected_output(operation, prompt_tokens, model)
+        # Every failed call is paid for and waited for again
+        retries = 1 / (1 - min(self.failure_rate(model), 0.9))
+        return retries * (
+            self.cost(model, prompt_tokens, output)
+            + self.latency_weight * self.latency(model, output)
+        )
+
+    def choose(self, operation, prompt_tokens, model=None):
+        # A model asked for explicitly is kept as long as it fits
+        if model is not None and self.fits(model, operation, prompt_tokens):
+            return model
+        candidates = [
+            name for name in self._operation(operation)["models"] if name in self.models
+        ]
+        if model in self.models and model not in candidates:
+            candidates.append(model)
+        healthy = [
+            name
+            for name in candidates
+            if self.failure_rate(name) <= self.max_failure_rate
+        ]
+        candidates = healthy or candidates
+
+        fitting = [
+            name for name in candidates if self.fits(name, operation, prompt_tokens)
+        ]
+        if fitting:
+            return min(
+                fitting, key=lambda name: self.score(name, operation, prompt_tokens)
+            )
+        # Nothing holds the whole completion: the largest context that holds
+        # the prompt, and continuation rounds for the rest
+        roomy = [
+            name for name in candidates if prompt_tokens < self.models[name]["context"]
+        ]
+        if not roomy:
+            raise ModelTooSmallError(
+                f"{prompt_tokens} tokens do not fit any model for {operation}"
+            )
+        return max(roomy, key=lambda name: self.models[name]["context"])
@@ -0,0 +1,83 @@
+import os
+import json
+import threading
+from collections import namedtuple
+from .import_scanner import scan_specifiers, is_relative
+
+SOURCE_EXTENSIONS = (".js", ".jsx", ".ts", ".tsx", ".mjs", ".cjs")
+
+MissingEdge = namedtuple("MissingEdge", ["file", "specifier", "kind", "line", "target"])
+
+
+class ModuleGraph:
+    # Relative-import graph of a tree: file -> files it imports, plus the
+    # imports that do not resolve. Specifiers are resolved with an ImportIndex.
+    def __init__(self, index):
+        self.index = index
+        self.edges = {}
+        self.missing = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, index, extensions=SOURCE_EXTENSIONS):
+        graph = cls(index)
+        for path in index.iter_files(extensions):
+            graph.add_file(path)
+        return graph
+
+    def add_file(self, path, source=None):
+        # Adds the file, or replaces its edges when it is already known
+        path = os.path.abspath(path)
+        if source is None:
+            with open(path, "r", encoding="utf-8", errors="replace") as file:
+                source = file.read()
+        dirname = os.path.dirname(path)
+        dependencies = set()
+        missing = []
+        for found in scan_specifiers(source):
+            if not is_relative(found.specifier):
+                continue
+            target = os.path.normpath(os.path.join(dirname, found.specifier))
+            resolved = self.index.resolve(target)
+            if resolved is not None:
+                dependencies.add(resolved)
+            else:
+                missing.append(
+                    MissingEdge(path, found.specifier, found.kind, found.line, target)
+                )
+        with self._lock:
+            self.edges[path] = dependencies
+            self.missing[path] = missing
+        return dependencies, missing
+
+    def dependencies(self, path):
+        with self._lock:
+            return set(self.edges.get(os.path.abspath(path), ()))
+
+    def dependents(self):
+        dependents = {}
+        with self._lock:
+            for path, dependencies in self.edges.items():
+                for dependency in dependencies:
+                    dependents.setdefault(dependency, set()).add(path)
+        return dependents
+
+    def missing_edges(self):
+        with self._lock:
+            return [edge for edges in self.missing.values() for edge in edges]
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "files": {
+                    path: sorted(dependencies)
+                    for path, dependencies in self.edges.items()
+                },
+                "missing": [
+                    edge._asdict() for edges in self.missing.values() for edge in edges
+                ],
+            }
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.to_dict(), file, indent=2)
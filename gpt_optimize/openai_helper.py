@@ -1,53 +1,132 @@
 import os
+import sys
+import json
 import time
-import tempfile
-from .jsvalidator import JsValidator
+import hashlib
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from .jsvalidator import PrettierWorker, PrettierWorkerError
 from .utils_func import sanitize_code_blocks
-from dotenv import load_dotenv
-import openai
-import tiktoken
-
-load_dotenv()
-
-
-class OpenAiApi:
-    def __init__(self, api_key):
-        openai.api_key = api_key
-
-    def chat(self, model, messages, temperature):
-        return openai.ChatCompletion.create(
-            model=model,
-            messages=messages,
-            temperature=temperature,
-        )
+from .rate_limiter import RateLimiter, RetryScheduler
+from .token_counter import TokenCounter
+from .budget import FileBudget
+from .metrics import Metrics
+from .backends import OpenAiBackend, to_response
+from .streaming import StreamProgress, StreamAbortedError, partial_output
+from .chunker import chunk_module, stitch_chunks
+from .compaction import compact_code, compact_prompt
+from .model_router import ModelRouter, ModelTooSmallError
+from .validation import (
+    ValidationPipeline,
+    SyntaxStage,
+    StructureStage,
+    AiReviewStage,
+)
 
 
 class ErrorHandler:
-    def __init__(self, logger):
+    def __init__(self, logger, rate_limiter=None, retry_scheduler=None):
         self.logger = logger
-        self.retry_delay = 5  # seconds
+        self.rate_limiter = rate_limiter
+        self.retry_scheduler = retry_scheduler or RetryScheduler()
+
+    @staticmethod
+    def error_type(e):
+        if isinstance(e, StreamAbortedError):
+            return "StreamAbortedError"
+        if isinstance(e, ModelTooSmallError):
+            return "ModelTooSmallError"
+        # The client is only imported by the backends that use it; an error
+        # can only come from it once it is loaded
+        openai = sys.modules.get("openai")
+        if getattr(e, "http_status", None) == 429 or (
+            openai is not None and isinstance(e, openai.error.RateLimitError)
+        ):
+            return "RateLimitError"
+        if openai is None:
+            return "GenericError"
+        if isinstance(e, openai.error.InvalidRequestError):
+            return "InvalidRequestError"
+        if isinstance(e, openai.error.OpenAIError):
+            return "OpenAIError"
+        return "GenericError"
 
-    def handle_error(self, e, type):
+    def handle_error(self, e, attempt, model=None):
+        type = self.error_type(e)
         error_msg = {
-            "OpenAIError": f"Unexpected finish reason: {e}",
-            "RateLimitError": f"RateLimitError occurred. Retrying in {self.retry_delay} seconds...",
+            "OpenAIError": f"OpenAI error: {e}",
+            "RateLimitError": f"RateLimitError occurred: {e}",
             "GenericError": f"Unexpected error: {e}",
             "InvalidRequestError": f"Invalid request error: {e}",
+            "StreamAbortedError": f"{e}",
+            "ModelTooSmallError": f"Code too large for GPT: {e}",
         }
-
         self.logger.error(error_msg[type])
 
-        if type == "RateLimitError":
-            time.sleep(self.retry_delay)
-            self.retry_delay *= 2  # exponential backoff
+        if type in (
+            "InvalidRequestError",
+            "ModelTooSmallError",
+        ) or not self.retry_scheduler.should_retry(attempt):
+            return False
+        if type == "StreamAbortedError":
+            # Nothing to wait for, the server did not push back
+            self.logger.info(f"Retrying now (attempt {attempt})...")
+            return True
+
+        delay = self.retry_scheduler.next_delay(
+            attempt - 1, self.retry_scheduler.retry_after(e)
+        )
+        if type == "RateLimitError" and self.rate_limiter is not None:
+            # Hold back every worker using this model, not only this one
+            self.rate_limiter.pause(model, delay)
+        self.logger.info(f"Retrying in {delay:.2f} seconds (attempt {attempt})...")
+        time.sleep(delay)
+        return True
 
 
 class OpenAiHelper:
-    def __init__(self, model, logger):
+    def __init__(
+        self,
+        model,
+        logger,
+        cache=None,
+        rate_limiter=None,
+        token_counter=None,
+        chunk_tokens=4000,
+        max_chunk_workers=8,
+        formatter=None,
+        validation_pipeline=None,
+        metrics=None,
+        backend=None,
+        stream=False,
+        compact_operations=(),
+        router=None,
+    ):
+        # None lets the router pick the model of every call
         self.model = model
+        self.router = router or ModelRouter()
+        self.stream = stream
+        self.compact_operations = set(compact_operations)
+        self.metrics = metrics or Metrics()
+        self.formatter = formatter or PrettierWorker(logger, metrics=self.metrics)
+        self.validation_pipeline = validation_pipeline or ValidationPipeline(
+            [
+                SyntaxStage(self.formatter),
+                StructureStage(),
+                AiReviewStage(self.validate_code_ai),
+            ],
+            logger,
+            self.metrics,
+        )
+        # Size of the chunks of a file too large for every model
+        self.chunk_tokens = chunk_tokens
+        self.max_chunk_workers = max_chunk_workers
         self.logger = logger
-        self.openai_api = OpenAiApi(os.getenv("OPENAI_API_KEY"))
-        self.error_handler = ErrorHandler(logger)
+        self.cache = cache
+        self.token_counter = token_counter or TokenCounter()
+        self.rate_limiter = rate_limiter or RateLimiter(logger=logger)
+        self.openai_api = backend or OpenAiBackend(os.getenv("OPENAI_API_KEY"))
+        self.error_handler = ErrorHandler(logger, self.rate_limiter)
 
     def openai_api_call(
         self,
@@ -56,35 +135,68 @@ class OpenAiHelper:
         user_content,
         system_content,
         temperature=0.5,
-        model="gpt-3.5-turbo-0613",
+        model=None,
         messages=None,
+        budget=None,
     ):
-        self.logger.info(f"Calling API... {model}")
-        content = []
+        model = model or self.model
+        cache_key = None
+        if self.cache is not None and messages is None:
+            # Under routing the tables that pick the model stand in for it, so
+            # a changed --models-config does not serve another model's output
+            cache_key = self.cache.make_key(
+                model or f"router:{self.router.version()}",
+                system_key,
+                system_content,
+                user_content,
+                code,
+                temperature,
+            )
+            cached_content = self.cache.get(cache_key)
+            if cached_content is not None:
+                self.logger.info(f"Cache hit for {system_key} ({model})")
+                return cached_content
+
         if messages is None:
             messages = self.create_messages(system_content, user_content, code)
-        model = self.check_and_update_model(messages, model)
 
-        retry_count = 0
-        while retry_count < 5:
-            self.logger.debug(f"Entering loop : Retry count: {retry_count}")
+        progress = None
+        if self.stream and system_key == "optimise":
+            progress = StreamProgress(messages[2]["content"], partial_output.get())
+
+        attempt = 0
+        while True:
+            self.logger.debug(f"Entering loop : Attempt: {attempt}")
+            # Routed again on every attempt, failures may have moved the choice
+            routed_model = model
             try:
-                response = self.perform_api_call(model, messages, temperature)
+                routed_model = self.route_model(system_key, messages, model)
+                self.logger.info(f"Calling API... {routed_model}")
+                if progress is not None:
+                    progress.start()
+                response = self.perform_api_call(
+                    routed_model, messages, temperature, budget, progress
+                )
                 self.logger.debug(f"Response: {response}")
                 content, messages = self.handle_response(
-                    response, content, messages, system_key
+                    response, [], messages, system_key, budget, progress, model
                 )
                 self.logger.debug(f"Returning: \n{content}\n {messages}")
+                if (
+                    cache_key is not None
+                    and content
+                    and not (budget is not None and budget.degraded)
+                ):
+                    self.cache.set(cache_key, content)
                 return content
-            except (
-                openai.error.RateLimitError,
-                openai.error.OpenAIError,
-                Exception,
-            ) as e:
-                self.error_handler.handle_error(e)
-                retry_count += 1
-                continue
-        return None
+            except Exception as e:
+                attempt += 1
+                self.metrics.record("retry", model=routed_model, error=type(e).__name__)
+                if not self.error_handler.handle_error(e, attempt, routed_model):
+                    return None
+            finally:
+                if progress is not None:
+                    progress.close()
 
     def create_messages(self, system_content, user_content, code):
         return [
@@ -93,104 +205,435 @@ class OpenAiHelper:
             {"role": "user", "content": code},
         ]
 
-    def check_and_update_model(self, messages, model):
+    def route_model(self, operation, messages, model=None):
         token_count = self.calculate_token_consumption(messages)
-        self.logger.info(f"Token count: {token_count}")
-        if token_count > 4000 and model != "gpt-3.5-turbo-16k":
-            self.logger.info("Switching to 16k model")
-            return "gpt-3.5-turbo-16k"
-        elif token_count > 15500:
-            raise Exception("Code too large for GPT")
-        return model
-
-    def perform_api_call(self, model, messages, temperature):
+        routed_model = self.router.choose(operation, token_count, model)
+        self.logger.info(f"Token count: {token_count}, model: {routed_model}")
+        self.metrics.record(
+            "model_route",
+            model=routed_model,
+            requested=model,
+            operation=operation,
+            tokens=token_count,
+        )
+        return routed_model
+
+    def perform_api_call(
+        self, model, messages, temperature, budget=None, progress=None
+    ):
         self.logger.debug(f"Performing API call with model: {model}")
-        return self.openai_api.chat(model, messages, temperature)
+        # Budget for a completion about as long as the prompt; the bucket is
+        # corrected with the real usage once the response is back.
+        estimated_tokens = 2 * self.calculate_token_consumption(messages)
+        with self.metrics.timer("throttle", model=model):
+            self.rate_limiter.acquire(model, estimated_tokens)
+        with self.metrics.timer("api_call", model=model) as call:
+            try:
+                if self.stream:
+                    response = self.stream_api_call(
+                        model, messages, temperature, estimated_tokens // 2, progress
+                    )
+                else:
+                    response = self.openai_api.chat(model, messages, temperature)
+            except Exception as e:
+                # Rate limits are the rate limiter's business, not the model's
+                if self.error_handler.error_type(e) != "RateLimitError":
+                    self.router.record(model, failed=True)
+                raise
+            self.router.record(model, failed=False)
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                call["prompt_tokens"] = usage["prompt_tokens"]
+                call["completion_tokens"] = usage["completion_tokens"]
+                call["cost"] = self.router.cost(
+                    model, usage["prompt_tokens"], usage["completion_tokens"]
+                )
+        if usage is not None:
+            self.rate_limiter.record_usage(
+                model, estimated_tokens, usage["total_tokens"]
+            )
+            if budget is not None:
+                budget.add_tokens(usage["total_tokens"])
+        return response
 
-    def handle_response(self, response, content, messages, system_key):
+    def stream_api_call(
+        self, model, messages, temperature, prompt_tokens, progress=None
+    ):
+        # Consumes the completion as it arrives: partial code is written out,
+        # the stream is dropped as soon as it goes off the rails, and a
+        # length stop returns at once so the continuation can start
+        monitor = progress.monitor() if progress is not None else None
+        started_at = time.perf_counter()
+        pieces = []
+        finish_reason = None
+        stream = self.openai_api.stream_chat(model, messages, temperature)
+        try:
+            for text, finish_reason in stream:
+                if text:
+                    if not pieces:
+                        self.metrics.record(
+                            "first_token", time.perf_counter() - started_at, model=model
+                        )
+                    pieces.append(text)
+                    if progress is not None:
+                        progress.write(text)
+                    reason = monitor.feed(text) if monitor is not None else None
+                    if reason is not None:
+                        self.metrics.record("stream_abort", model=model, reason=reason)
+                        raise StreamAbortedError(reason)
+                if finish_reason is not None:
+                    break
+        finally:
+            stream.close()
+
+        content = "".join(pieces)
+        # Streamed completions carry no usage, so it is counted locally
+        completion_tokens = self.token_counter.count(content)
+        return to_response(
+            {
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": finish_reason or "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            }
+        )
+
+    def handle_response(
+        self,
+        response,
+        content,
+        messages,
+        system_key,
+        budget=None,
+        progress=None,
+        model=None,
+    ):
+        content, response = self.collect_continuations(
+            response, content, system_key, budget, progress, model
+        )
+        # An answer still cut short ran out of budget; it goes through the
+        # same validation, it is not kept unparsed
+        if system_key == "optimise" and response.choices[0].finish_reason in (
+            "stop",
+            "length",
+        ):
+            self.logger.debug(
+                f"Returning response. \n {response.choices[0].message.content}"
+            )
+            return self.handle_optimise_response(
+                response, content, messages, budget, progress, model
+            )
+        elif response.choices[0].finish_reason in ["content_filter", "null"]:
+            raise Exception("Content Filter Error")
+        return content, messages
+
+    def collect_continuations(
+        self, response, content, system_key, budget=None, progress=None, model=None
+    ):
         content.append(response.choices[0].message.content)
         while response.choices[0].finish_reason == "length":
+            if (
+                budget is not None
+                and budget.exhausted(include_iterations=False) is not None
+            ):
+                self.logger.warning("Budget exhausted. Not continuing...")
+                budget.degraded = True
+                break
             self.logger.info("Length exceeded. Continuing...")
+            self.metrics.record("continuation")
             messages = self.create_messages(
                 self._prepare_system_content(system_key),
                 "Please continue",
                 response.choices[0].message.content,
             )
-            model = self.check_and_update_model(messages, self.model)
-            response = self.perform_api_call(model, messages, temperature=0.5)
-            content.append(response.choices[0].message.content)
-        if system_key == "optimise" and response.choices[0].finish_reason == "stop":
-            self.logger.debug(
-                f"Returning response. \n {response.choices[0].message.content}"
+            response = self.perform_api_call(
+                self.route_model(system_key, messages, model),
+                messages,
+                temperature=0.5,
+                budget=budget,
+                progress=progress,
             )
-            return self.handle_optimise_response(response, content, messages)
-        elif response.choices[0].finish_reason in ["content_filter", "null"]:
-            raise Exception("Content Filter Error")
-        return content, messages
+            content.append(response.choices[0].message.content)
+        return content, response
 
-    def handle_optimise_response(self, response, content, messages):
+    def handle_optimise_response(
+        self, response, content, messages, budget=None, progress=None, model=None
+    ):
+        budget = budget if budget is not None else FileBudget()
         self.logger.info("Optimisation complete. Validating...")
+        original_code = messages[2]["content"]
+        # Only a candidate that at least parses is worth keeping
+        best_candidate = (0, None)
         while True:
-            finished_content = " ".join(str(x) for x in content)
+            budget.add_iteration()
             self.logger.info("Sanitize optimized code...")
-            is_validate_code = self.validate_code_ai(finished_content)
-            if is_validate_code == "valid":
-                finished_content, validation = self._validate_and_sanitise_code(
-                    finished_content
+            with self.metrics.timer("sanitise"):
+                finished_content = sanitize_code_blocks(
+                    "".join(str(x) for x in content)
                 )
-                if validation is True:
-                    self.logger.info("Code validated. Returning...")
-                    break
+            validation = self.validation_pipeline.run(
+                finished_content, original_code, budget
+            )
+            if validation.valid:
+                self.logger.info("Code validated. Returning...")
+                return [validation.code], messages
+            if validation.passed_stages > best_candidate[0]:
+                best_candidate = (validation.passed_stages, validation.code)
+
+            reason = (
+                "validation unavailable" if validation.terminal else budget.exhausted()
+            )
+            if reason is not None:
+                if best_candidate[1] is None:
+                    self.logger.warning(
+                        f"Optimisation stopped ({reason}). No candidate parses."
+                    )
+                    return None, messages
+                self.logger.warning(
+                    f"Optimisation stopped ({reason}). Keeping best candidate..."
+                )
+                budget.degraded = True
+                return [best_candidate[1]], messages
 
             self.logger.info("Invalid code. Continuing...")
-            self.logger.debug(f"Invalid code: {is_validate_code}")
-            messages[2]["content"] = finished_content
-            messages.append({"role": "user", "content": is_validate_code})
-            content = self.openai_api_call(
-                finished_content,
-                "optimise",
-                self._prepare_user_content("optimise"),
-                self._prepare_system_content("optimise"),
-                messages=messages,
+            self.logger.debug(f"Invalid code: {validation.feedback}")
+            # Only the latest candidate and its critique are sent back, so the
+            # conversation does not grow with every round
+            messages = messages[:2] + [
+                {"role": "user", "content": finished_content},
+                {"role": "user", "content": validation.feedback},
+            ]
+            routed_model = self.route_model("optimise", messages, model)
+            if progress is not None:
+                progress.start()
+            response = self.perform_api_call(
+                routed_model,
+                messages,
+                temperature=0.5,
+                budget=budget,
+                progress=progress,
+            )
+            content, response = self.collect_continuations(
+                response, [], "optimise", budget, progress, model
             )
-            finished_content = " ".join(content)
-        return content, messages
 
     def calculate_token_consumption(self, messages):
-        total_tokens = 0
-        for message in messages:
-            encoding = tiktoken.encoding_for_model("gpt-4")
-            tokens = encoding.encode(message["content"])
-            total_tokens += len(tokens)
-        return total_tokens
-
-    def validate_code_ai(self, code):
+        with self.metrics.timer("tokens"):
+            return self.token_counter.count_messages(messages)
+
+    def compact(self, operation, code, user_content, system_content):
+        # Input tokens dominate the cost and latency of every call, so the
+        # prompts and the code are sent without what the model does not need
+        with self.metrics.timer("compaction", operation=operation) as compaction:
+            before = self.calculate_token_consumption(
+                self.create_messages(system_content, user_content, code)
+            )
+            compacted = compact_code(code)
+            user_content = compact_prompt(user_content)
+            system_content = compact_prompt(system_content)
+            after = self.calculate_token_consumption(
+                self.create_messages(system_content, user_content, compacted.code)
+            )
+            compaction.update(
+                tokens_before=before, tokens_after=after, tokens_saved=before - after
+            )
+        return compacted, user_content, system_content
+
+    def estimate_call(self, code, operation):
+        # Prompt tokens, model and expected cost of one call, without making it
+        user_content = self._prepare_user_content(operation)
+        system_content = self._prepare_system_content(operation)
+        if operation in self.compact_operations:
+            compacted, user_content, system_content = self.compact(
+                operation, code, user_content, system_content
+            )
+            code = compacted.code
+        tokens = self.calculate_token_consumption(
+            self.create_messages(system_content, user_content, code)
+        )
+        model = self.router.choose(operation, tokens, self.model)
+        output = self.router.expected_output(operation, tokens, model)
+        return tokens, model, self.router.cost(model, tokens, output)
+
+    def should_chunk(self, code, user_content, system_content, model=None):
+        # A file is only split when no model allowed to optimise it holds the
+        # whole file and its answer; a chunk loses the rest of the module
+        tokens = self.calculate_token_consumption(
+            self.create_messages(system_content, user_content, code)
+        )
+        return not self.router.fits_any("optimise", tokens, model)
+
+    def estimate_code(self, code):
+        # One optimisation of every chunk and one review of its result,
+        # assuming answers about as long as the code that pass at once
+        pieces = [code]
+        user_content = self._prepare_user_content("optimise")
+        system_content = self._prepare_system_content("optimise")
+        checked_code = code
+        if "optimise" in self.compact_operations:
+            compacted, user_content, system_content = self.compact(
+                "optimise", code, user_content, system_content
+            )
+            checked_code = compacted.code
+        if self.should_chunk(checked_code, user_content, system_content, self.model):
+            header, chunks = chunk_module(
+                code, self.chunk_tokens, self.token_counter.count
+            )
+            if len(chunks) >= 2:
+                pieces = [header + chunk for chunk in chunks]
+        tokens, models, cost = 0, set(), 0
+        for piece in pieces:
+            for operation in ("optimise", "validate"):
+                call_tokens, model, call_cost = self.estimate_call(piece, operation)
+                tokens += call_tokens
+                models.add(model)
+                # None once any model is missing from the price tables
+                cost = None if cost is None or call_cost is None else cost + call_cost
+        return tokens, sorted(models), cost
+
+    def validate_code_ai(self, code, budget=None):
+        user_content = self._prepare_user_content("validate")
+        system_content = self._prepare_system_content("validate")
+        if "validate" in self.compact_operations:
+            compacted, user_content, system_content = self.compact(
+                "validate", code, user_content, system_content
+            )
+            code = compacted.code
         is_validate_code = self.openai_api_call(
             code,
             "validate",
-            self._prepare_user_content("validate"),
-            self._prepare_system_content("validate"),
+            user_content,
+            system_content,
+            budget=budget,
         )
-        if is_validate_code[0].lower().startswith("valid"):
+        if is_validate_code is None:
+            # The review call gave up, there is no verdict
+            return None
+        is_validate_code = "".join(is_validate_code)
+        if is_validate_code.lower().startswith("valid"):
             return "valid"
-        return is_validate_code[0]
+        return is_validate_code
 
     def process_code(
-        self, code, operation, compressed=False, model="gpt-3.5-turbo-0613"
+        self,
+        code,
+        operation,
+        compressed=False,
+        model=None,
+        budget=None,
+        context=None,
     ):
         self.logger.info(f"{operation.capitalize()}ing code, please wait...")
         user_content = self._prepare_user_content(operation, compressed)
+        if context:
+            user_content = f"{user_content}\n{context}"
         system_content = self._prepare_system_content(operation)
-        result_code = self.openai_api_call(
-            code, operation, user_content, system_content, model=model
-        )
+        compacted = None
+        if operation in self.compact_operations:
+            compacted, user_content, system_content = self.compact(
+                operation, code, user_content, system_content
+            )
+            code = compacted.code
+        if operation == "optimise" and self.should_chunk(
+            code, user_content, system_content, model or self.model
+        ):
+            result_code = self.process_chunked_code(
+                code, user_content, system_content, model, budget
+            )
+        else:
+            result_code = self.openai_api_call(
+                code,
+                operation,
+                user_content,
+                system_content,
+                model=model,
+                budget=budget,
+            )
         if isinstance(result_code, list):
             result_code = "".join(result_code)
+        if compacted is not None:
+            result_code = compacted.restore(result_code)
         if operation in ["optimise", "generate_test"]:
             self.logger.debug(f"{operation.capitalize()}d code: {result_code}")
 
         return result_code
 
+    def prompt_version(self, operations=("optimise", "validate"), context=None):
+        # Compaction and the file's own context (dependency exports, a
+        # near-duplicate) change what is sent as much as the prompts do
+        prompts = [
+            self._prepare_system_content(operation)
+            + self._prepare_user_content(operation)
+            for operation in operations
+        ]
+        payload = json.dumps([prompts, sorted(self.compact_operations), context])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:12]
+
+    def process_chunked_code(
+        self, code, user_content, system_content, model, budget=None
+    ):
+        header, chunks = chunk_module(code, self.chunk_tokens, self.token_counter.count)
+        if len(chunks) < 2:
+            return self.openai_api_call(
+                code,
+                "optimise",
+                user_content,
+                system_content,
+                model=model,
+                budget=budget,
+            )
+
+        self.logger.info(f"Code too large, optimising {len(chunks)} chunks...")
+        # Each chunk runs in a copy of the caller's context so its metrics are
+        # still attributed to the file being processed. Chunks do not stream
+        # into the partial output, they would overwrite each other.
+        contexts = [contextvars.copy_context() for _ in chunks]
+        for context in contexts:
+            context.run(partial_output.set, None)
+        budgets = (
+            budget.split(len(chunks)) if budget is not None else [None] * len(chunks)
+        )
+        with ThreadPoolExecutor(
+            max_workers=min(len(chunks), self.max_chunk_workers)
+        ) as executor:
+            results = list(
+                executor.map(
+                    lambda context, chunk, chunk_budget: context.run(
+                        self.openai_api_call,
+                        header + chunk,
+                        "optimise",
+                        user_content,
+                        system_content,
+                        model=model,
+                        budget=chunk_budget,
+                    ),
+                    contexts,
+                    chunks,
+                    budgets,
+                )
+            )
+        if any(result is None for result in results):
+            self.logger.error("Failed to optimise at least one chunk.")
+            return None
+
+        stitched_code = stitch_chunks(
+            [sanitize_code_blocks("".join(result)) for result in results]
+        )
+        stitched_code, validation = self._validate_and_sanitise_code(stitched_code)
+        if validation is not True:
+            self.logger.error(f"Stitched code is invalid: {validation}")
+            return None
+        return stitched_code
+
     def _prepare_user_content(self, operation, compressed=False):
         compressed_prompt = ""
         if compressed is True:
@@ -266,17 +709,13 @@ class OpenAiHelper:
         if isinstance(code, list):
             code = "".join(code)
 
-        sanitized_code = sanitize_code_blocks(code)
-        with tempfile.NamedTemporaryFile(mode="w", delete=False) as temp:
-            temp.write(sanitized_code)
-            temp_path = temp.name
-
-        validator = JsValidator(temp_path)
-        formatted_code = validator.format()
-        if formatted_code:
-            with open(temp_path, "r") as file:
-                file_contents = file.read()
-            os.unlink(temp_path)
-            return file_contents, True
-        else:
-            return file_contents, formatted_code
+        with self.metrics.timer("sanitise"):
+            sanitized_code = sanitize_code_blocks(code)
+        try:
+            valid, formatted_code = self.formatter.format(sanitized_code)
+        except PrettierWorkerError as e:
+            valid, formatted_code = False, str(e)
+        if valid:
+            return formatted_code, True
+        self.logger.warning(f"Prettier found issues: {formatted_code}")
+        return sanitized_code, formatted_code
@@ -0,0 +1,184 @@
+import os
+import json
+import zipfile
+import threading
+
+_TEMP_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0)
+
+
+def _create_temp(path):
+    # Like mkstemp, but created with 0o666 so the kernel applies the umask
+    # and outputs get the usual permissions rather than owner-only ones
+    dir_name = os.path.dirname(path) or "."
+    while True:
+        temp_path = os.path.join(
+            dir_name, f".{os.path.basename(path)}.{os.urandom(6).hex()}.tmp"
+        )
+        try:
+            return os.open(temp_path, _TEMP_FLAGS, 0o666), temp_path
+        except FileExistsError:
+            continue
+
+
+def _replace_atomically(path, write):
+    # Writes through a temp file in the target directory and renames it over
+    # the target, so readers and crashes only ever see a complete file
+    fd, temp_path = _create_temp(path)
+    try:
+        with os.fdopen(fd, "wb") as file:
+            write(file)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class TreeWriter:
+    # Outputs as loose files. Each file is replaced atomically, directories
+    # are created once, and small files are held back and written in groups.
+    def __init__(self, small_file_bytes=16384, flush_bytes=1 << 20, flush_files=64):
+        self.small_file_bytes = small_file_bytes
+        self.flush_bytes = flush_bytes
+        self.flush_files = flush_files
+        self._dirs = set()
+        self._pending = {}
+        self._pending_bytes = 0
+        # Callbacks waiting for a held back file to reach the disk
+        self._callbacks = {}
+        self._lock = threading.Lock()
+        self._dir_lock = threading.Lock()
+
+    def _ensure_dir(self, dir_name):
+        if not dir_name or dir_name in self._dirs:
+            return
+        with self._dir_lock:
+            if dir_name not in self._dirs:
+                os.makedirs(dir_name, exist_ok=True)
+                self._dirs.add(dir_name)
+
+    def _write_file(self, path, data):
+        self._ensure_dir(os.path.dirname(path))
+        _replace_atomically(path, lambda file: file.write(data))
+
+    def write(self, path, text):
+        data = text.encode("utf-8")
+        if len(data) >= self.small_file_bytes:
+            with self._lock:
+                previous = self._pending.pop(path, None)
+                if previous is not None:
+                    self._pending_bytes -= len(previous)
+                callbacks = self._callbacks.pop(path, [])
+            self._write_file(path, data)
+            for callback in callbacks:
+                callback()
+            return
+        with self._lock:
+            previous = self._pending.get(path)
+            if previous is not None:
+                self._pending_bytes -= len(previous)
+            self._pending[path] = data
+            self._pending_bytes += len(data)
+            full = (
+                self._pending_bytes >= self.flush_bytes
+                or len(self._pending) >= self.flush_files
+            )
+        if full:
+            self.flush()
+
+    def when_written(self, path, callback):
+        # Runs callback once the latest output of path is on disk, e.g. to
+        # record it in the manifest only when a crash can no longer lose it
+        with self._lock:
+            if path in self._pending:
+                self._callbacks.setdefault(path, []).append(callback)
+                return
+        callback()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            callbacks, self._callbacks = self._callbacks, {}
+            self._pending_bytes = 0
+        for path, data in pending.items():
+            self._write_file(path, data)
+        for path_callbacks in callbacks.values():
+            for callback in path_callbacks:
+                callback()
+
+    def read(self, path):
+        with self._lock:
+            data = self._pending.get(path)
+        if data is not None:
+            return data.decode("utf-8")
+        if not os.path.isfile(path):
+            return None
+        with open(path, "r", encoding="utf-8") as file:
+            return file.read()
+
+    def close(self):
+        self.flush()
+
+
+class ArchiveWriter:
+    # Outputs collected in memory and written as a single zip or JSON lines
+    # file, relative to the output folder, when the run is over
+    def __init__(self, archive_path, output_dir_path, archive_format="zip"):
+        self.archive_path = archive_path
+        self.output_dir_path = output_dir_path
+        self.archive_format = archive_format
+        self.entries = {}
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def _name(self, path):
+        return os.path.relpath(path, self.output_dir_path).replace(os.sep, "/")
+
+    def write(self, path, text):
+        with self._lock:
+            self.entries[self._name(path)] = text
+
+    def flush(self):
+        # Nothing reaches the disk before close, so a crash leaves the
+        # previous archive untouched
+        pass
+
+    def when_written(self, path, callback):
+        with self._lock:
+            self._callbacks.append(callback)
+
+    def read(self, path):
+        with self._lock:
+            return self.entries.get(self._name(path))
+
+    def _write_zip(self, file):
+        with zipfile.ZipFile(file, "w", zipfile.ZIP_DEFLATED) as archive:
+            for name in sorted(self.entries):
+                archive.writestr(name, self.entries[name])
+
+    def _write_jsonl(self, file):
+        for name in sorted(self.entries):
+            record = {"path": name, "content": self.entries[name]}
+            file.write((json.dumps(record) + "\n").encode("utf-8"))
+
+    def close(self):
+        with self._lock:
+            os.makedirs(os.path.dirname(self.archive_path) or ".", exist_ok=True)
+            write = (
+                self._write_zip if self.archive_format == "zip" else self._write_jsonl
+            )
+            _replace_atomically(self.archive_path, write)
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+def create_writer(output_format, output_dir_path):
+    if output_format == "tree":
+        return TreeWriter()
+    if output_format in ("zip", "jsonl"):
+        output_dir_path = os.path.normpath(output_dir_path)
+        return ArchiveWriter(
+            f"{output_dir_path}.{output_format}", output_dir_path, output_format
+        )
+    raise ValueError(f"Unknown output format: {output_format}")
@@ -0,0 +1,36 @@
+// Long-lived Prettier formatter speaking line-delimited JSON over stdin/stdout.
+// Request:  {"id": 1, "source": "...", "parser": "babel"}
+// Response: {"id": 1, "ok": true, "formatted": "..."} or {"id": 1, "ok": false, "error": "..."}
+const readline = require("readline");
+
+function respond(message) {
+  process.stdout.write(JSON.stringify(message) + "\n");
+}
+
+let prettier;
+try {
+  prettier = require("prettier");
+} catch (error) {
+  respond({ id: null, ok: false, error: `Cannot load prettier: ${error.message}` });
+  process.exit(1);
+}
+
+const lines = readline.createInterface({ input: process.stdin });
+
+lines.on("line", async (line) => {
+  let request;
+  try {
+    request = JSON.parse(line);
+  } catch (error) {
+    return;
+  }
+  try {
+    // prettier.format is synchronous in v2 and returns a promise in v3
+    const formatted = await prettier.format(request.source, {
+      parser: request.parser || "babel",
+    });
+    respond({ id: request.id, ok: true, formatted });
+  } catch (error) {
+    respond({ id: request.id, ok: false, error: String(error.message || error) });
+  }
+});
@@ -0,0 +1,116 @@
+import time
+import random
+import threading
+
+# (requests per minute, tokens per minute) per model
+DEFAULT_LIMITS = {
+    "gpt-3.5-turbo-0613": (3500, 90000),
+    "gpt-3.5-turbo-16k": (3500, 180000),
+    "gpt-4": (200, 40000),
+}
+
+
+class TokenBucket:
+    def __init__(self, capacity, refill_per_second):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity,
+            self.tokens + (now - self.updated_at) * self.refill_per_second,
+        )
+        self.updated_at = now
+
+    def reserve(self, amount):
+        # Takes the amount straight away (the balance may go negative) and
+        # returns how long the caller has to wait before it is covered, so
+        # concurrent callers queue up behind each other.
+        with self._lock:
+            self._refill()
+            self.tokens -= min(amount, self.capacity)
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.refill_per_second
+
+    def adjust(self, amount):
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    def __init__(
+        self, limits=None, default_limits=(3500, 90000), logger=None, share=1.0
+    ):
+        self.limits = dict(DEFAULT_LIMITS if limits is None else limits)
+        self.default_limits = default_limits
+        # Fraction of the limits this process may use, when several processes
+        # share an API key
+        self.share = share
+        self.logger = logger
+        self._buckets = {}
+        self._paused_until = {}
+        self._lock = threading.Lock()
+
+    def _get_buckets(self, model):
+        with self._lock:
+            if model not in self._buckets:
+                rpm, tpm = self.limits.get(model, self.default_limits)
+                rpm, tpm = rpm * self.share, tpm * self.share
+                self._buckets[model] = (
+                    TokenBucket(rpm, rpm / 60),
+                    TokenBucket(tpm, tpm / 60),
+                )
+            return self._buckets[model]
+
+    def acquire(self, model, token_count):
+        requests, tokens = self._get_buckets(model)
+        wait = max(requests.reserve(1), tokens.reserve(token_count))
+        wait = max(wait, self._paused_until.get(model, 0) - time.monotonic())
+        if wait > 0:
+            if self.logger is not None:
+                self.logger.debug(f"Throttling {model} for {wait:.2f}s")
+            time.sleep(wait)
+
+    def record_usage(self, model, estimated_tokens, used_tokens):
+        _, tokens = self._get_buckets(model)
+        tokens.adjust(estimated_tokens - used_tokens)
+
+    def pause(self, model, seconds):
+        with self._lock:
+            self._paused_until[model] = max(
+                self._paused_until.get(model, 0), time.monotonic() + seconds
+            )
+
+
+class RetryScheduler:
+    def __init__(self, base_delay=1, max_delay=60, max_retries=5):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+
+    def should_retry(self, attempt):
+        return attempt < self.max_retries
+
+    def next_delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        # Full jitter keeps concurrent workers from retrying in lockstep
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    @staticmethod
+    def retry_after(e):
+        headers = getattr(e, "headers", None) or {}
+        try:
+            if "retry-after-ms" in headers:
+                return float(headers["retry-after-ms"]) / 1000
+            if "retry-after" in headers:
+                return float(headers["retry-after"])
+        except (TypeError, ValueError):
+            return None
+        return None
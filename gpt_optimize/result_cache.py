@@ -0,0 +1,72 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+
+
+class ResultCache:
+    def __init__(self, cache_dir=".gpt_optimize_cache", max_size=512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._size = sum(size for _, _, size in self._entries())
+
+    @staticmethod
+    def make_key(model, operation, system_content, user_content, code, temperature):
+        code_hash = hashlib.sha256(code.encode("utf-8")).hexdigest()
+        payload = json.dumps(
+            [model, operation, system_content, user_content, code_hash, temperature]
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for file in files:
+                if not file.endswith(".json"):
+                    continue
+                path = os.path.join(root, file)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_mtime, stat.st_size
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                value = json.load(file)
+            # Reads refresh the mtime so eviction follows least recent use
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            return None
+        return value
+
+    def set(self, key, value):
+        path = self._path(key)
+        data = json.dumps(value).encode("utf-8")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._lock:
+            previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            os.replace(temp_path, path)
+            self._size += len(data) - previous_size
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        for path, _, size in sorted(self._entries(), key=lambda entry: entry[1]):
+            if self._size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self._size -= size
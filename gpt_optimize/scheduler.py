@@ -0,0 +1,160 @@
+import os
+from .js_tokenizer import tokenize, NAME, PUNCT, COMMENT
+
+_OPENING = set("([")
+_CLOSING = set(")]")
+
+
+def _strongly_connected(graph):
+    # Tarjan's algorithm, iterative so deep import chains do not hit the
+    # recursion limit. Maps every node to the index of its component.
+    index, lowlink, component = {}, {}, {}
+    stack, on_stack = [], set()
+    for root in sorted(graph):
+        if root in index:
+            continue
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(sorted(graph[root])))]
+        while work:
+            node, children = work[-1]
+            child = next(children, None)
+            if child is not None:
+                if child not in index:
+                    index[child] = lowlink[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(sorted(graph[child]))))
+                elif child in on_stack:
+                    lowlink[node] = min(lowlink[node], index[child])
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                lowlink[parent] = min(lowlink[parent], lowlink[node])
+            if lowlink[node] == index[node]:
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component[member] = index[node]
+                    if member == node:
+                        break
+    return component
+
+
+def topological_waves(dependencies):
+    # dependencies maps each file to the files it imports. Every wave only
+    # depends on earlier waves, so the files of a wave can run in parallel.
+    # The files of an import cycle share a wave, the files importing the
+    # cycle still wait for it.
+    graph = {
+        path: set(imported) & dependencies.keys() - {path}
+        for path, imported in dependencies.items()
+    }
+    component = _strongly_connected(graph)
+    members, dependents, waiting = {}, {}, {}
+    for path, imported in graph.items():
+        members.setdefault(component[path], []).append(path)
+        waiting.setdefault(component[path], set())
+        for other in imported:
+            if component[other] != component[path]:
+                waiting[component[path]].add(component[other])
+    for key, imported in waiting.items():
+        for other in imported:
+            dependents.setdefault(other, []).append(key)
+    waiting = {key: len(imported) for key, imported in waiting.items()}
+    waves = []
+    ready = [key for key, count in waiting.items() if not count]
+    while ready:
+        waves.append(sorted(path for key in ready for path in members[key]))
+        following = []
+        for key in ready:
+            for dependent in dependents.get(key, ()):
+                waiting[dependent] -= 1
+                if not waiting[dependent]:
+                    following.append(dependent)
+        ready = following
+    return waves
+
+
+def _signature_end(tokens, position):
+    # Index just past the head of the export statement at position: up to
+    # its body, initialiser or end of line, keeping parameter lists whole
+    first = tokens[position + 1]
+    if first.kind == PUNCT and first.value in "{*":
+        index = position + 1
+        while index < len(tokens):
+            token = tokens[index]
+            if token.kind == PUNCT and token.value == ";":
+                return index
+            if index > position + 1 and token.line > tokens[index - 1].line:
+                if tokens[index - 1].value not in ("{", ","):
+                    return index
+            index += 1
+        return index
+
+    depth = 0
+    index = position + 1
+    while index < len(tokens):
+        token = tokens[index]
+        if token.kind == PUNCT and token.value in _OPENING:
+            depth += 1
+        elif token.kind == PUNCT and token.value in _CLOSING:
+            depth -= 1
+        elif depth == 0:
+            if token.kind == PUNCT and token.value in "{;":
+                return index
+            if token.kind == PUNCT and token.value == "=":
+                following = tokens[index + 1] if index + 1 < len(tokens) else None
+                if following is not None and following.value == ">":
+                    return index + 2
+                if following is not None and (
+                    following.value in ("(", "async")
+                    or (
+                        index + 2 < len(tokens)
+                        and following.kind == NAME
+                        and tokens[index + 2].value == "="
+                    )
+                ):
+                    # Arrow function: keep its parameters
+                    index += 1
+                    continue
+                return index
+            if token.line > tokens[index - 1].line:
+                return index
+        index += 1
+    return index
+
+
+def export_signatures(source, max_signatures=20, max_length=200):
+    tokens = [token for token in tokenize(source) if token.kind != COMMENT]
+    signatures = []
+    for position, token in enumerate(tokens[:-1]):
+        if token.kind != NAME or token.value != "export":
+            continue
+        if position > 0 and tokens[position - 1].value == ".":
+            continue
+        end = _signature_end(tokens, position)
+        text = source[token.start : tokens[end - 1].end]
+        signatures.append(" ".join(text.split())[:max_length])
+        if len(signatures) >= max_signatures:
+            break
+    return signatures
+
+
+def dependency_context(path, dependencies, signatures):
+    lines = []
+    for dependency in sorted(dependencies):
+        if not signatures.get(dependency):
+            continue
+        specifier = os.path.relpath(dependency, os.path.dirname(path))
+        if not specifier.startswith("."):
+            specifier = f"./{specifier}"
+        lines.append(f"{specifier}: {'; '.join(signatures[dependency])}")
+    if not lines:
+        return None
+    return (
+        "The relative imports below are already optimised. "
+        "Use them as they are exported:\n" + "\n".join(lines)
+    )
@@ -0,0 +1,152 @@
+import os
+import contextvars
+
+# Where the optimised code of the file being processed is written while it
+# streams in, or None
+partial_output = contextvars.ContextVar("partial_output", default=None)
+
+# Characters of code punctuation expected in any stretch of real code
+_CODE_CHARS = set("{}()[];=<>")
+
+
+class StreamAbortedError(Exception):
+    def __init__(self, reason):
+        super().__init__(f"Stream aborted: {reason}")
+        self.reason = reason
+
+
+class FenceStripper:
+    # Incremental sanitize_code_blocks: lines inside ``` fences are emitted as
+    # soon as they are complete. finish() returns what sanitize_code_blocks
+    # would have returned for the whole text.
+    def __init__(self):
+        self.buffer = ""
+        self.text = []
+        self.code_lines = []
+        self.in_code_block = False
+        self.code_block_found = False
+
+    def _line(self, line):
+        if line.strip().startswith("```"):
+            self.in_code_block = not self.in_code_block
+            self.code_block_found = True
+            return None
+        if self.in_code_block:
+            self.code_lines.append(line)
+            return line
+        return None
+
+    def feed(self, text):
+        self.text.append(text)
+        lines = (self.buffer + text).split("\n")
+        self.buffer = lines.pop()
+        return [line for line in map(self._line, lines) if line is not None]
+
+    def finish(self):
+        self._line(self.buffer)
+        self.buffer = ""
+        if self.code_block_found:
+            return "\n".join(self.code_lines)
+        return "".join(self.text)
+
+
+class StreamMonitor:
+    # Spots completions that went off the rails while they stream: prose
+    # where code was expected, or the model looping over the same text.
+    # Text that also occurs in the original code is never taken for a loop.
+    def __init__(
+        self,
+        reference="",
+        prose_chars=400,
+        max_repeated_lines=8,
+        repeat_tail=200,
+        repeat_count=4,
+        repeat_window=4000,
+    ):
+        self.reference = reference
+        self.reference_lines = set(reference.split("\n"))
+        self.prose_chars = prose_chars
+        self.max_repeated_lines = max_repeated_lines
+        self.repeat_tail = repeat_tail
+        self.repeat_count = repeat_count
+        self.repeat_window = repeat_window
+        # Only the latest stretch of text is kept, never the whole completion
+        self.window = ""
+        self.size = 0
+        self.buffer = ""
+        self.last_line = None
+        self.repeats = 0
+        self.fence_seen = False
+        self.prose_checked = False
+
+    def _looks_like_prose(self, text):
+        code_chars = sum(char in _CODE_CHARS for char in text)
+        return code_chars < len(text) / 100 and ". " in text
+
+    def feed(self, text):
+        self.window = (self.window + text)[-self.repeat_window :]
+        self.size += len(text)
+        lines = (self.buffer + text).split("\n")
+        self.buffer = lines.pop()
+        for line in lines:
+            if line.strip().startswith("```"):
+                self.fence_seen = True
+            if len(line.strip()) < 10 or line in self.reference_lines:
+                continue
+            if line == self.last_line:
+                self.repeats += 1
+                if self.repeats >= self.max_repeated_lines:
+                    return "repetition"
+            else:
+                self.last_line = line
+                self.repeats = 0
+
+        if (
+            not self.fence_seen
+            and not self.prose_checked
+            and self.size >= self.prose_chars
+        ):
+            self.prose_checked = True
+            if self._looks_like_prose(self.window):
+                return "prose"
+
+        if lines and self.size >= self.repeat_tail * self.repeat_count:
+            tail = self.window[-self.repeat_tail :]
+            if (
+                self.window.count(tail) >= self.repeat_count
+                and tail not in self.reference
+            ):
+                return "repetition"
+        return None
+
+
+class StreamProgress:
+    # State of one streamed optimisation conversation: the code it started
+    # from and the partial output file, which is rewritten for every new
+    # candidate and extended by continuations
+    def __init__(self, reference, path=None):
+        self.reference = reference
+        self.path = path
+        self.stripper = FenceStripper()
+        self.file = None
+
+    def start(self):
+        self.stripper = FenceStripper()
+        if self.path is not None:
+            self.close()
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.file = open(self.path, "w", encoding="utf-8")
+
+    def write(self, text):
+        lines = self.stripper.feed(text)
+        if self.file is not None and lines:
+            self.file.write("\n".join(lines) + "\n")
+            self.file.flush()
+
+    def monitor(self):
+        return StreamMonitor(self.reference)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,119 @@
+import json
+import argparse
+import itertools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .backends import StubBackend, StubRateLimitError
+
+
+def create_handler(backend):
+    class StubHandler(BaseHTTPRequestHandler):
+        def _send(self, status, payload, headers=None):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_stream(self, model, pieces):
+            # Server-sent events in the format of the streaming chat API
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            for text, finish_reason in pieces:
+                chunk = {
+                    "object": "chat.completion.chunk",
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "delta": {"content": text},
+                            "finish_reason": finish_reason,
+                        }
+                    ],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+            try:
+                if request.get("stream"):
+                    pieces = backend.stream_chat(
+                        request["model"],
+                        request["messages"],
+                        request.get("temperature"),
+                    )
+                    # Errors are raised before the first piece, while a
+                    # status can still be sent
+                    first = next(pieces)
+                    self._send_stream(
+                        request["model"], itertools.chain([first], pieces)
+                    )
+                    return
+                response = backend.chat(
+                    request["model"], request["messages"], request.get("temperature")
+                )
+            except StubRateLimitError as e:
+                self._send(
+                    429,
+                    {"error": {"message": str(e), "type": "rate_limit_exceeded"}},
+                    e.headers,
+                )
+                return
+            self._send(200, response)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubHandler
+
+
+def serve(backend, host="127.0.0.1", port=8080):
+    server = ThreadingHTTPServer((host, port), create_handler(backend))
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="OpenAI-compatible chat completions server backed by the stub backend."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--latency-jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--truncate-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--chars-per-second",
+        type=float,
+        default=0,
+        help="Simulated generation speed; 0 answers at once.",
+    )
+    parser.add_argument("--recording", help="JSONL file of recorded responses.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = serve(
+        StubBackend(
+            latency=args.latency,
+            latency_jitter=args.latency_jitter,
+            error_rate=args.error_rate,
+            truncate_rate=args.truncate_rate,
+            recording_path=args.recording,
+            seed=args.seed,
+            chars_per_second=args.chars_per_second,
+        ),
+        args.host,
+        args.port,
+    )
+    print(f"Stub server listening on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
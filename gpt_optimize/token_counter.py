@@ -0,0 +1,52 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+def get_encoding(model="gpt-4"):
+    # Loading an encoding reads and parses the BPE ranks, so do it once per process
+    with _encodings_lock:
+        if model not in _encodings:
+            import tiktoken
+
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        return _encodings[model]
+
+
+class TokenCounter:
+    def __init__(self, model="gpt-4", max_entries=50000):
+        self.model = model
+        self.max_entries = max_entries
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, text):
+        key = hashlib.sha1(text.encode("utf-8")).digest()
+        with self._lock:
+            if key in self._counts:
+                self._counts.move_to_end(key)
+                return self._counts[key]
+
+        count = len(get_encoding(self.model).encode(text, disallowed_special=()))
+
+        with self._lock:
+            self._counts[key] = count
+            if len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+        return count
+
+    def count_messages(self, messages):
+        return sum(self.count(message["content"]) for message in messages)
+
+    def count_files(self, paths, max_workers=8):
+        def count_file(path):
+            with open(path, "r", encoding="utf-8") as file:
+                return path, self.count(file.read())
+
+        # tiktoken encodes outside the GIL, so threads scale across files
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return dict(executor.map(count_file, paths))
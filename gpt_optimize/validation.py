@@ -0,0 +1,152 @@
+import re
+from collections import namedtuple
+from .js_tokenizer import tokenize, NAME, PUNCT, COMMENT
+from .missing_import import MissingImport
+from .jsvalidator import PrettierWorkerError
+
+# terminal: the stage could not run at all, another round would not help
+ValidationResult = namedtuple(
+    "ValidationResult",
+    ["valid", "code", "feedback", "passed_stages", "terminal"],
+    defaults=(0, False),
+)
+
+_EXPORT_DECLARATORS = {
+    "function",
+    "class",
+    "const",
+    "let",
+    "var",
+    "interface",
+    "type",
+    "enum",
+}
+_OMISSION_PATTERN = re.compile(
+    r"(\.\.\.|…)\s*(rest|remaining|existing|other|same|more)\b", re.IGNORECASE
+)
+
+
+def exported_names(source):
+    tokens = [token for token in tokenize(source) if token.kind != COMMENT]
+    names = set()
+    for position, token in enumerate(tokens):
+        if token.kind != NAME or token.value != "export":
+            continue
+        following = tokens[position + 1 : position + 4]
+        if not following:
+            continue
+        if following[0].value == "default":
+            names.add("default")
+        elif following[0].kind == PUNCT and following[0].value == "{":
+            # export { a, b as c }
+            index = position + 2
+            while index < len(tokens) and tokens[index].value != "}":
+                next_value = tokens[index + 1].value if index + 1 < len(tokens) else "}"
+                if tokens[index].kind == NAME and next_value in (",", "}"):
+                    names.add(tokens[index].value)
+                index += 1
+        else:
+            for candidate, name in zip(following, following[1:]):
+                if candidate.value in _EXPORT_DECLARATORS and name.kind == NAME:
+                    names.add(name.value)
+                    break
+    return names
+
+
+class SyntaxStage:
+    name = "syntax"
+
+    def __init__(self, formatter):
+        self.formatter = formatter
+
+    def validate(self, code, original_code, budget=None):
+        try:
+            valid, formatted_code = self.formatter.format(code)
+        except PrettierWorkerError as e:
+            # Prettier itself is broken: no answer could pass, and retrying
+            # the call would only pay for more of them
+            return ValidationResult(False, code, f"invalid:\n- {e}", terminal=True)
+        if valid:
+            return ValidationResult(True, formatted_code, None)
+        return ValidationResult(
+            False, code, f"invalid:\n- The code does not parse: {formatted_code}"
+        )
+
+
+class StructureStage:
+    name = "structure"
+
+    def __init__(self, min_size_ratio=0.3):
+        self.min_size_ratio = min_size_ratio
+        self.missing_import = MissingImport()
+
+    def validate(self, code, original_code, budget=None):
+        problems = []
+        if len(code.strip()) < self.min_size_ratio * len(original_code.strip()):
+            problems.append(
+                "The code is much shorter than the original, no portion of the code may be omitted."
+            )
+        if _OMISSION_PATTERN.search(
+            " ".join(t.value for t in tokenize(code) if t.kind == COMMENT)
+        ):
+            problems.append("The code contains placeholders for omitted code.")
+
+        missing_exports = exported_names(original_code) - exported_names(code)
+        if missing_exports:
+            problems.append(
+                f"These exports are missing: {', '.join(sorted(missing_exports))}."
+            )
+
+        added_imports = set(self.missing_import.detect_relative_imports(code)) - set(
+            self.missing_import.detect_relative_imports(original_code)
+        )
+        if added_imports:
+            problems.append(
+                f"These relative imports were added: {', '.join(sorted(added_imports))}."
+            )
+
+        if problems:
+            feedback = "invalid:\n" + "\n".join(f"- {problem}" for problem in problems)
+            return ValidationResult(False, code, feedback)
+        return ValidationResult(True, code, None)
+
+
+class AiReviewStage:
+    name = "ai_review"
+
+    def __init__(self, review):
+        self.review = review
+
+    def validate(self, code, original_code, budget=None):
+        review = self.review(code, budget)
+        if review is None:
+            return ValidationResult(
+                False, code, "invalid:\n- The review failed.", terminal=True
+            )
+        if review == "valid":
+            return ValidationResult(True, code, None)
+        return ValidationResult(False, code, review)
+
+
+class ValidationPipeline:
+    def __init__(self, stages, logger=None, metrics=None):
+        self.stages = stages
+        self.logger = logger
+        self.metrics = metrics
+
+    def run(self, code, original_code, budget=None):
+        # Stages run cheapest first; the first failure skips the rest and its
+        # feedback is what gets sent back to the model
+        for passed_stages, stage in enumerate(self.stages):
+            if self.metrics is not None:
+                with self.metrics.timer(f"validate_{stage.name}") as timing:
+                    result = stage.validate(code, original_code, budget)
+                    timing["valid"] = result.valid
+            else:
+                result = stage.validate(code, original_code, budget)
+            if not result.valid:
+                if self.logger is not None:
+                    self.logger.info(f"Validation failed at stage: {stage.name}")
+                return result._replace(passed_stages=passed_stages)
+            code = result.code
+        return ValidationResult(True, code, None, len(self.stages))
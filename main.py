@@ -1,14 +1,34 @@
 from gpt_optimize.gpt_optimize import CodeProcessor
+from gpt_optimize.batch import BatchProcessor
+from gpt_optimize.backends import create_backend
+from gpt_optimize.manifest import Manifest
+from gpt_optimize.metrics import Metrics
+from gpt_optimize.rate_limiter import RateLimiter
+from gpt_optimize.model_router import ModelRouter
+from gpt_optimize.result_cache import ResultCache
+from gpt_optimize.job_queue import JobQueue, Worker, enqueue_directory
+from gpt_optimize.output_writer import create_writer
 import argparse
+import asyncio
 import logging
+import multiprocessing
 import os
-from dotenv import load_dotenv
 
 
 def parse_args():
+    # Loaded here rather than on import, so embedding the package reads no .env
+    from dotenv import load_dotenv
+
     load_dotenv()  # Load .env variables
 
     parser = argparse.ArgumentParser(description="Your Script Description.")
+    parser.add_argument(
+        "command",
+        nargs="?",
+        choices=["run", "enqueue", "worker"],
+        default="run",
+        help="run processes the input folder in this process; enqueue writes it to the job queue for worker processes to pick up.",
+    )
     parser.add_argument(
         "--input", default=os.getenv("INPUT", "input"), help="Path to the input folder."
     )
@@ -19,11 +39,223 @@ def parse_args():
     )
     parser.add_argument(
         "--codebase_path",
-        default=os.getenv("CODEBASE_PATH", False),
-        action="store_true",
+        default=os.getenv("CODEBASE_PATH"),
         help="Path to your project codebase.",
     )
 
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=int(os.getenv("CONCURRENCY", 1)),
+        help="Number of files processed in parallel (1 keeps the sequential mode).",
+    )
+
+    parser.add_argument(
+        "--backend",
+        choices=["openai", "compatible", "stub"],
+        default=os.getenv("BACKEND", "openai"),
+        help="LLM backend: the OpenAI API, any OpenAI-compatible server or the local stub.",
+    )
+    parser.add_argument(
+        "--base-url",
+        default=os.getenv("BASE_URL"),
+        help="Base URL of the OpenAI-compatible server, e.g. http://127.0.0.1:8080/v1.",
+    )
+    parser.add_argument(
+        "--stub-latency",
+        type=float,
+        default=0.0,
+        help="Seconds the stub backend waits before answering.",
+    )
+    parser.add_argument(
+        "--stub-error-rate",
+        type=float,
+        default=0.0,
+        help="Share of stub calls failing with a rate limit error.",
+    )
+    parser.add_argument(
+        "--stub-truncate-rate",
+        type=float,
+        default=0.0,
+        help='Share of stub answers cut short with finish_reason="length".',
+    )
+    parser.add_argument(
+        "--stub-recording",
+        help="JSONL file of recorded responses replayed by the stub backend.",
+    )
+    parser.add_argument(
+        "--record",
+        default=os.getenv("RECORD"),
+        help="Append every response of the selected backend to this JSONL file, for --stub-recording to replay.",
+    )
+
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        default=os.getenv("STREAM", False),
+        help="Stream completions: write partial output, abort runaway answers early and continue truncated ones at once.",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="List the files to process with their estimated tokens and cost, without calling the API.",
+    )
+    parser.add_argument(
+        "--model",
+        default=os.getenv("MODEL"),
+        help="Model to use whenever the code fits it. By default the router picks the model of every call.",
+    )
+    parser.add_argument(
+        "--models-config",
+        default=os.getenv("MODELS_CONFIG"),
+        help="JSON file of models (context, prices, latency) and of the models allowed per operation, merged into the built-in tables.",
+    )
+    parser.add_argument(
+        "--compact",
+        default=os.getenv("COMPACT", ""),
+        help="Comma separated operations (optimise, validate) whose prompts and code are compacted before they are sent.",
+    )
+    parser.add_argument(
+        "--chunk-tokens",
+        type=int,
+        default=int(os.getenv("CHUNK_TOKENS", 4000)),
+        help="Size in tokens of the chunks a file is split into when no model allowed to optimise it can hold it whole.",
+    )
+    parser.add_argument(
+        "--output-format",
+        choices=["tree", "zip", "jsonl"],
+        default=os.getenv("OUTPUT_FORMAT", "tree"),
+        help="Write the output folder as loose files, or as a single <output>.zip or <output>.jsonl archive.",
+    )
+    parser.add_argument(
+        "--queue",
+        default=os.getenv("QUEUE", "jobs.sqlite3"),
+        help="sqlite job queue shared by enqueue and worker.",
+    )
+    parser.add_argument(
+        "--lease-seconds",
+        type=int,
+        default=int(os.getenv("LEASE_SECONDS", 600)),
+        help="How long a job stays with a worker that stopped sending heartbeats.",
+    )
+    parser.add_argument(
+        "--requeue",
+        action="store_true",
+        help="With enqueue, put already processed files back in the queue.",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=int(os.getenv("PROCESSES", 1)),
+        help="With worker, number of worker processes to start.",
+    )
+    parser.add_argument(
+        "--rate-share",
+        type=float,
+        default=float(os.getenv("RATE_SHARE", 1.0)),
+        help="Fraction of the rate limits this process may use, when several workers share an API key.",
+    )
+
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        default=os.getenv("DEDUP", False),
+        help="Optimise one file per group of files identical up to whitespace and comments, and copy its result to the others.",
+    )
+    parser.add_argument(
+        "--near-duplicates",
+        type=float,
+        default=os.getenv("NEAR_DUPLICATES"),
+        help="Similarity (0-1) above which a file is given an optimised near-duplicate as a starting point; implies --dedup.",
+    )
+    parser.add_argument(
+        "--rpm",
+        type=int,
+        default=os.getenv("RPM"),
+        help="Requests per minute allowed for every model (overrides the built-in limits).",
+    )
+    parser.add_argument(
+        "--tpm",
+        type=int,
+        default=os.getenv("TPM"),
+        help="Tokens per minute allowed for every model (overrides the built-in limits).",
+    )
+
+    parser.add_argument(
+        "--max-iterations",
+        type=int,
+        default=os.getenv("MAX_ITERATIONS", 4),
+        help="Maximum optimise/validate rounds per file.",
+    )
+    parser.add_argument(
+        "--max-file-tokens",
+        type=int,
+        default=os.getenv("MAX_FILE_TOKENS", 60000),
+        help="Maximum tokens spent on a single file.",
+    )
+    parser.add_argument(
+        "--max-file-seconds",
+        type=int,
+        default=os.getenv("MAX_FILE_SECONDS", 600),
+        help="Maximum wall-clock time spent on a single file.",
+    )
+
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always call the API instead of reusing cached results.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=os.getenv("CACHE_DIR", ".gpt_optimize_cache"),
+        help="Directory of the on-disk result cache.",
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        type=int,
+        default=int(os.getenv("CACHE_MAX_MB", 512)),
+        help="Size limit of the result cache before least recently used entries are evicted.",
+    )
+
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        default=os.getenv("INCREMENTAL", False),
+        help="Skip files whose output is up to date according to the run manifest.",
+    )
+
+    parser.add_argument(
+        "--import-index",
+        default=os.getenv("IMPORT_INDEX", None),
+        help="File persisting the codebase import index between runs; it is refreshed by directory mtime instead of rebuilt.",
+    )
+
+    parser.add_argument(
+        "--import-report",
+        default=os.getenv("IMPORT_REPORT", "missing_imports.jsonl"),
+        help="JSON lines file listing every relative import of the codebase that does not resolve.",
+    )
+    parser.add_argument(
+        "--import-graph",
+        default=os.getenv("IMPORT_GRAPH"),
+        help="Optional JSON file receiving the codebase dependency graph.",
+    )
+
+    parser.add_argument(
+        "--metrics",
+        default=os.getenv("METRICS_FILE", "metrics.jsonl"),
+        help="JSON lines file receiving one event per API call, validation step and file.",
+    )
+
+    parser.add_argument(
+        "--emit-batch",
+        help="Write one batch API request per input file to this JSONL file and exit.",
+    )
+    parser.add_argument(
+        "--ingest-batch",
+        help="Validate and save the responses of a batch results JSONL file and exit.",
+    )
+
     parser.add_argument(
         "--debug",
         action="store_true",
@@ -34,7 +266,64 @@ def parse_args():
     return parser.parse_args()
 
 
+def run_workers(args):
+    # Each process gets its own processor and an equal part of the limits
+    worker_args = argparse.Namespace(
+        **{
+            **vars(args),
+            "processes": 1,
+            "rate_share": args.rate_share / args.processes,
+        }
+    )
+    processes = [
+        multiprocessing.Process(target=main, args=(worker_args,))
+        for _ in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+def print_estimates(processor, input_dir_path):
+    total_tokens, total_cost, count, unpriced = 0, 0, 0, 0
+    for path, tokens, models, cost in processor.estimate_directory(input_dir_path):
+        count += 1
+        total_tokens += tokens
+        if models is None:
+            print(f"{tokens:>8} tokens  too large for any model  {path}")
+            continue
+        if cost is None:
+            unpriced += 1
+            print(f"{tokens:>8} tokens  cost unknown  {','.join(models)}  {path}")
+            continue
+        total_cost += cost
+        print(f"{tokens:>8} tokens  ${cost:.4f}  {','.join(models)}  {path}")
+    print(f"{count} files, {total_tokens} tokens, estimated cost ${total_cost:.4f}")
+    if unpriced:
+        print(f"{unpriced} files use models without prices, not included in the cost")
+
+
+def check_formatter(processor):
+    # Without Prettier no answer can be validated, stop before paying for any
+    error = processor.openai.formatter.check()
+    if error is not None:
+        raise SystemExit(f"Prettier is not available: {error}")
+
+
 def main(args):
+    if args.command == "worker" and args.output_format != "tree":
+        raise SystemExit(
+            "Workers share their outputs as files, use --output-format tree"
+        )
+    if args.incremental and args.output_format != "tree":
+        # An archive is rewritten with this run's files only, and the manifest
+        # cannot find its outputs on disk
+        raise SystemExit("--incremental needs --output-format tree")
+    if args.command == "worker" and args.processes > 1:
+        run_workers(args)
+        return
+
     if args.debug:
         logging.basicConfig(level=logging.DEBUG)
     else:
@@ -45,12 +334,143 @@ def main(args):
     print("Input path:", args.input)
     print("Output path:", args.output)
     print("Codebase path:", args.codebase_path)
+    print("Concurrency:", args.concurrency)
+
+    cache = None
+    if not args.no_cache and not args.dry_run:
+        cache = ResultCache(args.cache_dir, max_size=args.cache_max_mb * 1024 * 1024)
 
-    processor = CodeProcessor(logger=logging, model="gpt-3.5-turbo-0613")
-    processor.process_directory(
-        args.input, args.output, code_base_path=args.codebase_path
+    manifest = Manifest(Manifest.path_for(args.output))
+
+    rate_limiter = RateLimiter(logger=logging, share=args.rate_share)
+    if args.rpm or args.tpm:
+        rate_limiter = RateLimiter(
+            limits={},
+            default_limits=(args.rpm or 3500, args.tpm or 90000),
+            logger=logging,
+            share=args.rate_share,
+        )
+
+    metrics = Metrics(args.metrics)
+    router = ModelRouter.load(args.models_config) if args.models_config else None
+
+    backend = create_backend(
+        args.backend,
+        api_key=os.getenv("OPENAI_API_KEY"),
+        base_url=args.base_url,
+        latency=args.stub_latency,
+        error_rate=args.stub_error_rate,
+        truncate_rate=args.stub_truncate_rate,
+        recording_path=args.stub_recording,
+        record_path=args.record,
+    )
+
+    processor = CodeProcessor(
+        logger=logging,
+        model=args.model,
+        cache=cache,
+        manifest=manifest,
+        incremental=args.incremental,
+        rate_limiter=rate_limiter,
+        max_iterations=args.max_iterations,
+        max_file_tokens=args.max_file_tokens,
+        max_file_seconds=args.max_file_seconds,
+        metrics=metrics,
+        backend=backend,
+        import_index_path=args.import_index,
+        stream=args.stream,
+        dedup=args.dedup,
+        near_duplicate_threshold=args.near_duplicates,
+        output_writer=create_writer(args.output_format, args.output),
+        compact_operations=[
+            operation.strip()
+            for operation in args.compact.split(",")
+            if operation.strip()
+        ],
+        router=router,
+        chunk_tokens=args.chunk_tokens,
+    )
+    if args.dry_run:
+        print_estimates(processor, args.input)
+        return
+
+    if args.emit_batch or args.ingest_batch:
+        batch = BatchProcessor(processor)
+        if args.emit_batch:
+            batch.emit(args.input, args.emit_batch)
+        if args.ingest_batch:
+            check_formatter(processor)
+            batch.ingest(args.ingest_batch, args.input, args.output, args.codebase_path)
+            processor.output.close()
+            processor.openai.formatter.close()
+            processor.missing_imports.save_index()
+            processor.missing_imports.write_report(
+                args.import_report, args.import_graph
+            )
+            print(metrics.format_summary())
+        return
+
+    if args.command == "enqueue":
+        queue = JobQueue(args.queue, args.lease_seconds)
+        count = enqueue_directory(
+            processor,
+            queue,
+            args.input,
+            args.output,
+            args.codebase_path,
+            reset=args.requeue,
+        )
+        logging.info(f"Enqueued {count} files in {args.queue}: {queue.counts()}")
+        return
+
+    if args.command == "worker":
+        queue = JobQueue(args.queue, args.lease_seconds)
+        check_formatter(processor)
+        worker = Worker(processor, queue)
+        processed = worker.run()
+        processor.output.close()
+        processor.openai.formatter.close()
+        logging.info(
+            f"{worker.worker_id} processed {processed} files: {queue.counts()}"
+        )
+        # Workers only know the files they processed, so each writes its own
+        # report
+        report_root, report_extension = os.path.splitext(args.import_report)
+        processor.missing_imports.write_report(
+            f"{report_root}.{os.getpid()}{report_extension}"
+        )
+        print(metrics.format_summary())
+        return
+
+    check_formatter(processor)
+    token_counts = processor.count_directory_tokens(
+        args.input, max_workers=max(args.concurrency, 8)
+    )
+    logging.info(
+        f"Estimated input tokens: {sum(token_counts.values())} "
+        f"across {len(token_counts)} files"
     )
 
+    if args.concurrency > 1:
+        asyncio.run(
+            processor.process_directory_async(
+                args.input,
+                args.output,
+                code_base_path=args.codebase_path,
+                concurrency=args.concurrency,
+            )
+        )
+    else:
+        processor.process_directory(
+            args.input, args.output, code_base_path=args.codebase_path
+        )
+
+    processor.output.close()
+    processor.openai.formatter.close()
+    processor.missing_imports.save_index()
+    processor.missing_imports.write_report(args.import_report, args.import_graph)
+    print(metrics.format_summary())
+
 
 if __name__ == "__main__":
     args = parse_args()
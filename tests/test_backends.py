@@ -0,0 +1,29 @@
+from gpt_optimize.backends import create_backend, RecordingBackend, StubBackend
+
+MESSAGES = [
+    {"role": "system", "content": "You optimise code."},
+    {"role": "user", "content": "Optimise this."},
+    {"role": "user", "content": "const a = 1;"},
+]
+
+
+def test_recorded_responses_are_replayed(tmp_path):
+    recording = str(tmp_path / "recording.jsonl")
+    backend = create_backend("stub", truncate_rate=1.0, record_path=recording)
+    assert isinstance(backend, RecordingBackend)
+    recorded = backend.chat("gpt-4", MESSAGES, 0.5).choices[0]
+    streamed = "".join(
+        text for text, _ in backend.stream_chat("gpt-4", MESSAGES[:2], 0.5)
+    )
+
+    replay = create_backend("stub", recording_path=recording)
+    replayed = replay.chat("gpt-4", MESSAGES, 0.5).choices[0]
+    assert replayed.message.content == recorded.message.content
+    assert replayed.finish_reason == recorded.finish_reason == "length"
+    assert replay.chat("gpt-4", MESSAGES[:2], 0.5).choices[0].message.content == (
+        streamed
+    )
+
+
+def test_no_recording_by_default():
+    assert isinstance(create_backend("stub"), StubBackend)
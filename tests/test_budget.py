@@ -0,0 +1,38 @@
+import time
+from gpt_optimize.budget import FileBudget
+
+
+def test_iterations_tokens_and_time():
+    budget = FileBudget(max_iterations=2, max_tokens=100, max_seconds=60)
+    assert budget.exhausted() is None
+    budget.add_iteration()
+    budget.add_iteration()
+    assert budget.exhausted() == "iterations"
+    assert budget.exhausted(include_iterations=False) is None
+    budget.add_tokens(100)
+    assert budget.exhausted(include_iterations=False) == "tokens"
+    budget.started_at = time.monotonic() - 61
+    assert FileBudget(max_seconds=60).exhausted() is None
+    budget.max_tokens = 0
+    assert budget.exhausted(include_iterations=False) == "time"
+
+
+def test_chunks_have_their_own_rounds_and_tokens():
+    budget = FileBudget(max_iterations=1, max_tokens=100)
+    first, second = budget.split(2)
+    first.add_iteration()
+    first.add_tokens(100)
+    assert first.exhausted() == "iterations"
+    assert second.exhausted() is None
+    second.add_tokens(60)
+    assert budget.tokens == 160
+    assert budget.iterations == 0
+
+
+def test_chunks_share_the_clock_and_degradation():
+    budget = FileBudget(max_seconds=60)
+    budget.started_at = time.monotonic() - 61
+    (chunk,) = budget.split(1)
+    assert chunk.exhausted() == "time"
+    chunk.degraded = True
+    assert budget.degraded
@@ -0,0 +1,63 @@
+from gpt_optimize.chunker import split_module, chunk_module, stitch_chunks
+
+SOURCE = """import React from "react";
+import { a } from "./a";
+
+// A helper
+const helper = () => {
+  const inner = 1;
+  return inner;
+};
+
+export function First() {
+  return <div>{helper()}</div>;
+}
+
+export default function Second() {
+  const s = `template ${"{"} still inside`;
+  return s;
+}
+"""
+
+
+def test_split_keeps_imports_in_header():
+    header, segments = split_module(SOURCE)
+    assert "".join(header) == (
+        'import React from "react";\nimport { a } from "./a";\n\n// A helper\n'
+    )
+    assert [segment.split("\n", 1)[0] for segment in segments] == [
+        "const helper = () => {",
+        "export function First() {",
+        "export default function Second() {",
+    ]
+    assert "".join(header) + "".join(segments) == SOURCE
+
+
+def test_nested_declarations_do_not_split():
+    _, segments = split_module(SOURCE)
+    assert "const inner = 1;" in segments[0]
+
+
+def test_dynamic_import_is_not_a_header_line():
+    header, segments = split_module('import("./lazy");\nconst a = 1;\n')
+    assert header == []
+    assert segments == ['import("./lazy");\n', "const a = 1;\n"]
+
+
+def test_chunk_module_respects_budget():
+    header, chunks = chunk_module(SOURCE, 6, lambda text: len(text.split("\n")))
+    assert header.startswith("import React")
+    assert len(chunks) == 3
+    assert "".join(chunks) == "".join(split_module(SOURCE)[1])
+
+
+def test_stitch_deduplicates_imports_and_helpers():
+    first = 'import React from "react";\n\nconst helper = 1;\n\nexport const A = 1;\n'
+    second = (
+        'import React  from "react";\nimport B from "./b";\n\n'
+        "const helper = 2;\n\nexport const C = 3;\n"
+    )
+    assert stitch_chunks([first, second]) == (
+        'import React from "react";\nimport B from "./b";\n\n'
+        "const helper = 1;\n\nexport const A = 1;\n\nexport const C = 3;\n"
+    )
@@ -0,0 +1,88 @@
+from gpt_optimize.compaction import compact_code, compact_prompt
+
+URL = "https://example.com/a/really/long/path/to/some/resource.png"
+
+SOURCE = f"""// Header comment
+import React from "react";
+import Button from '../../components/shared/Button';
+/* eslint-disable no-console */
+
+export default function App() {{
+    const url = "{URL}";
+    // comment
+    return (
+        <div className="a  b">
+            {{/* jsx comment */}}
+            <a href={{url}}>Visit http://example.com now</a>
+            {{`multi
+     line`}}
+        </div>
+    ); // trailing
+}}
+"""
+
+
+def test_compact_code():
+    compacted = compact_code(SOURCE)
+    assert compacted.code == """import React from "react";
+import Button from '__s0__/Button';
+/* eslint-disable no-console */
+export default function App() {
+const url = "__s1__";
+return (
+<div className="a  b">
+{}
+<a href={url}>Visit http://example.com now</a>
+{`multi
+     line`}
+</div>
+); // trailing
+}
+"""
+    assert compacted.literals == {
+        "__s0__": "'../../components/shared/Button'",
+        "__s1__": f'"{URL}"',
+    }
+
+
+def test_restore_any_quotes():
+    compacted = compact_code(SOURCE)
+    answer = compacted.code.replace("'__s0__/Button'", '"__s0__/Button"').replace(
+        '"__s1__"', "`__s1__`"
+    )
+    restored = compacted.restore(answer)
+    assert "import Button from '../../components/shared/Button';" in restored
+    assert f'const url = "{URL}";' in restored
+    assert "__s" not in restored
+
+
+def test_package_names_and_short_specifiers_stay():
+    compacted = compact_code(
+        "import { Card } from 'react-bootstrap';\nimport a from './a';\n"
+    )
+    assert compacted.literals == {}
+    assert "'react-bootstrap'" in compacted.code
+
+
+def test_repeated_literal_shares_placeholder():
+    source = f'const a = "{URL}";\nconst b = "{URL}";\n'
+    compacted = compact_code(source)
+    assert list(compacted.literals) == ["__s0__"]
+    assert compacted.restore(compacted.code) == source
+
+
+def test_placeholder_prefix_avoids_source_collisions():
+    source = f'const __s0__ = "{URL}";\n'
+    compacted = compact_code(source)
+    assert list(compacted.literals) == ["__gpto_s0__"]
+    assert compacted.restore(compacted.code) == source
+
+
+def test_restore_leaves_code_without_placeholders():
+    compacted = compact_code("const a = 1;\n")
+    assert compacted.restore(None) is None
+    assert compacted.restore("const b = 2;") == "const b = 2;"
+
+
+def test_compact_prompt():
+    assert compact_prompt("  a\n      b   c\n\n   d  ") == "a\nb c\nd"
@@ -0,0 +1,54 @@
+import logging
+from gpt_optimize.dedup import Deduplicator, normalised_tokens
+from gpt_optimize.gpt_optimize import CodeProcessor
+
+
+def test_whitespace_and_comments_are_ignored():
+    assert normalised_tokens("const a = 1; // one\nconst b = 2;") == normalised_tokens(
+        "const  a=1;\n\n  /* one */\n\tconst b = 2;"
+    )
+
+
+def test_line_breaks_are_kept():
+    # Semicolon insertion: the first returns undefined
+    assert normalised_tokens("return\nx") != normalised_tokens("return x")
+    assert normalised_tokens("return /*\n*/ x") == normalised_tokens("return\nx")
+
+
+def write(path, code):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(code)
+    return str(path)
+
+
+def test_groups_follow_content_and_context(tmp_path):
+    first = write(tmp_path / "a.js", "const a = 1;\n")
+    second = write(tmp_path / "b.js", "const a = 1; // same\n")
+    third = write(tmp_path / "c.js", "const a = 1;\n")
+    groups = Deduplicator().group(
+        [first, second, third], {third: "./x.js: export const x"}
+    )
+    assert groups.duplicates == {first: [second]}
+
+
+def test_copies_importing_different_modules_are_not_duplicates(tmp_path):
+    component = "import { x } from './x';\nexport const App = () => x();\n"
+    paths = [
+        write(tmp_path / "one" / "App.js", component),
+        write(tmp_path / "one" / "x.js", "export const x = () => 1;\n"),
+        write(tmp_path / "two" / "App.js", component),
+        write(tmp_path / "two" / "x.js", "export function x(a) { return a; }\n"),
+        write(tmp_path / "three" / "App.js", component),
+        write(tmp_path / "three" / "x.js", "export const x = () => 3;\n"),
+    ]
+    dependencies = {path: set() for path in paths}
+    for folder in ("one", "two", "three"):
+        dependencies[str(tmp_path / folder / "App.js")] = {
+            str(tmp_path / folder / "x.js")
+        }
+    processor = CodeProcessor(logging.getLogger("test"), dedup=True)
+    processor.deduplicate(dict.fromkeys(paths), dependencies)
+    # one and three import a module with the same exports
+    assert processor.duplicates == {
+        str(tmp_path / "one" / "App.js"): [str(tmp_path / "three" / "App.js")]
+    }
@@ -0,0 +1,100 @@
+import logging
+from gpt_optimize.gpt_optimize import CodeProcessor
+from gpt_optimize.backends import StubBackend
+from gpt_optimize.manifest import Manifest
+from gpt_optimize.result_cache import ResultCache
+
+
+class WordCounter:
+    def count(self, text):
+        return len(text.split())
+
+    def count_messages(self, messages):
+        return sum(self.count(message["content"]) for message in messages)
+
+
+class ParsesAll:
+    def format(self, source, parser="babel"):
+        return True, source
+
+
+def create_processor(tmp_path, **options):
+    processor = CodeProcessor(
+        logging.getLogger("test"), backend=StubBackend(), **options
+    )
+    processor.openai.token_counter = WordCounter()
+    processor.openai.formatter = ParsesAll()
+    processor.openai.validation_pipeline.stages[0].formatter = ParsesAll()
+    return processor
+
+
+def write_tree(root, files):
+    for name, code in files.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(code)
+
+
+def api_calls(processor):
+    return len(
+        [event for event in processor.metrics.events if event["stage"] == "api_call"]
+    )
+
+
+def run(tmp_path, **options):
+    processor = create_processor(
+        tmp_path,
+        manifest=Manifest(str(tmp_path / "output.manifest.jsonl")),
+        incremental=True,
+        **options,
+    )
+    processor.process_directory(str(tmp_path / "input"), str(tmp_path / "output"))
+    return processor
+
+
+def test_incremental_follows_dependencies_and_compaction(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_tree(
+        tmp_path / "input",
+        {
+            "app.js": "import { b } from './b';\nexport const app = () => b();\n",
+            "b.js": "export const b = () => 1;\n",
+            "c.js": "export const c = 3;\n",
+        },
+    )
+    assert api_calls(run(tmp_path)) == 6
+    assert api_calls(run(tmp_path)) == 0
+    # Compacting changes what is sent, every file is out of date
+    assert api_calls(run(tmp_path, compact_operations=["optimise"])) == 6
+    assert api_calls(run(tmp_path, compact_operations=["optimise"])) == 0
+
+    # b exports something else: b and the file importing it are redone
+    write_tree(tmp_path / "input", {"b.js": "export const b2 = () => 2;\n"})
+    processor = run(tmp_path, compact_operations=["optimise"])
+    optimised = {
+        event["file"]
+        for event in processor.metrics.events
+        if event["stage"] == "api_call"
+    }
+    assert optimised == {
+        str(tmp_path / "input" / "app.js"),
+        str(tmp_path / "input" / "b.js"),
+    }
+
+
+def test_cached_rerun_makes_no_calls(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_tree(
+        tmp_path / "input",
+        {
+            "app.js": "import { b } from './b';\nexport const app = () => b();\n",
+            "b.js": "export const b = () => 1;\n",
+        },
+    )
+    for calls in (4, 0):
+        processor = create_processor(
+            tmp_path, cache=ResultCache(str(tmp_path / "cache"))
+        )
+        processor.process_directory(str(tmp_path / "input"), str(tmp_path / "output"))
+        assert api_calls(processor) == calls
+        assert (tmp_path / "output" / "app.js").read_text().startswith("import")
@@ -0,0 +1,52 @@
+from gpt_optimize.import_scanner import (
+    scan_specifiers,
+    is_relative,
+    STATIC,
+    REEXPORT,
+    REQUIRE,
+    DYNAMIC,
+)
+
+
+def scan(source):
+    return [(spec.specifier, spec.kind, spec.line) for spec in scan_specifiers(source)]
+
+
+def test_all_import_forms():
+    source = """import React from "react";
+import {
+  a,
+  b as c,
+} from './multi';
+import './side-effect.css';
+export * from "../all";
+export { d } from './d';
+export type { T } from './types';
+const e = require('./e');
+const f = await import(`./f`);
+"""
+    assert scan(source) == [
+        ("react", STATIC, 1),
+        ("./multi", STATIC, 2),
+        ("./side-effect.css", STATIC, 6),
+        ("../all", REEXPORT, 7),
+        ("./d", REEXPORT, 8),
+        ("./types", REEXPORT, 9),
+        ("./e", REQUIRE, 10),
+        ("./f", DYNAMIC, 11),
+    ]
+
+
+def test_ignores_comments_strings_and_members():
+    source = """// import x from './commented';
+const s = "import y from './in-string'";
+obj.require('./member');
+const g = import(name);
+export const h = 1;
+"""
+    assert scan(source) == []
+
+
+def test_is_relative():
+    assert is_relative("./a") and is_relative("../a") and is_relative(".")
+    assert not is_relative("react") and not is_relative("@scope/pkg")
@@ -0,0 +1,67 @@
+from gpt_optimize.job_queue import JobQueue, DONE, FAILED
+
+
+def job(path, wave=0):
+    return {
+        "path": path,
+        "input_path": f"input/{path}",
+        "output_path": f"output/{path}",
+        "wave": wave,
+    }
+
+
+def test_expired_lease_returns_the_job(tmp_path):
+    # Leases expire as soon as they are granted
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), lease_seconds=-1)
+    queue.enqueue([job("a.js")])
+    first = queue.claim("first")
+    second = queue.claim("second")
+    assert second["id"] == first["id"]
+    assert second["attempts"] == 1 and second["error"] == "lease expired"
+    assert queue.counts() == {"leased": 1}
+
+
+def test_complete_is_rejected_once_the_lease_moved(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), lease_seconds=-1)
+    queue.enqueue([job("a.js")])
+    claimed = queue.claim("first")
+    queue.claim("second")
+    assert not queue.heartbeat(claimed["id"], "first")
+    assert not queue.complete(claimed["id"], "first", DONE)
+    assert queue.complete(claimed["id"], "second", DONE)
+    assert queue.counts() == {"done": 1}
+
+
+def test_max_attempts_marks_the_job_failed(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), lease_seconds=-1, max_attempts=2)
+    queue.enqueue([job("a.js")])
+    assert queue.claim("first") is not None
+    assert queue.claim("second") is not None
+    assert queue.claim("third") is None
+    assert queue.counts() == {FAILED: 1}
+    assert queue.unfinished() == 0
+
+
+def test_later_waves_wait_for_earlier_ones(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    queue.enqueue([job("b.js", wave=1), job("a.js"), job("c.js")])
+    first = queue.claim("worker")
+    second = queue.claim("worker")
+    assert {first["path"], second["path"]} == {"a.js", "c.js"}
+    assert queue.claim("worker") is None
+    queue.complete(first["id"], "worker", DONE)
+    # Failed jobs do not hold the next wave back
+    queue.complete(second["id"], "worker", FAILED, "not optimised")
+    assert queue.claim("worker")["path"] == "b.js"
+
+
+def test_enqueue_again_keeps_state_unless_reset(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    queue.enqueue([job("a.js")])
+    claimed = queue.claim("worker")
+    queue.complete(claimed["id"], "worker", DONE)
+    assert queue.enqueue([job("a.js"), job("b.js")]) == 1
+    assert queue.counts() == {"done": 1, "pending": 1}
+    queue.enqueue([job("a.js")], reset=True)
+    assert queue.counts() == {"pending": 2}
+    queue.close()
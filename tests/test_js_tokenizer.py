@@ -0,0 +1,75 @@
+from gpt_optimize.js_tokenizer import (
+    tokenize,
+    NAME,
+    STRING,
+    TEMPLATE,
+    REGEX,
+    NUMBER,
+    PUNCT,
+    COMMENT,
+)
+
+
+def kinds(source):
+    return [(token.kind, token.value) for token in tokenize(source)]
+
+
+def test_division_after_a_value():
+    assert kinds("a / b / 2") == [
+        (NAME, "a"),
+        (PUNCT, "/"),
+        (NAME, "b"),
+        (PUNCT, "/"),
+        (NUMBER, "2"),
+    ]
+
+
+def test_regex_after_operator_and_keyword():
+    assert (REGEX, "/a\\/b[/]c/gi") in kinds("x = /a\\/b[/]c/gi;")
+    assert (REGEX, "/x/") in kinds("return /x/.test(s)")
+
+
+def test_comments_are_not_regexes():
+    assert kinds("a // b / c\n/* d */ e") == [
+        (NAME, "a"),
+        (COMMENT, "// b / c"),
+        (COMMENT, "/* d */"),
+        (NAME, "e"),
+    ]
+
+
+def test_template_with_nested_expression():
+    tokens = kinds("`a ${ {b: `c ${d}`}.b } e`")
+    assert tokens[0] == (TEMPLATE, "`a ${")
+    assert (TEMPLATE, "`c ${") in tokens
+    assert (TEMPLATE, "}`") in tokens
+    assert tokens[-1] == (TEMPLATE, "} e`")
+
+
+def test_strings_with_escapes_and_other_quotes():
+    assert kinds("'it\\'s' \"say 'hi'\"") == [
+        (STRING, "'it\\'s'"),
+        (STRING, "\"say 'hi'\""),
+    ]
+
+
+def test_jsx_apostrophe_stops_at_end_of_line():
+    tokens = tokenize("<p>Don't stop</p>\nconst a = 1;")
+    string = next(token for token in tokens if token.kind == STRING)
+    assert string.value == "'t stop</p>"
+    assert [token.value for token in tokens if token.line == 2] == [
+        "const",
+        "a",
+        "=",
+        "1",
+        ";",
+    ]
+
+
+def test_positions_and_lines():
+    source = "a\n  /* x\n y */ b"
+    tokens = tokenize(source)
+    assert [source[token.start : token.end] for token in tokens] == [
+        token.value for token in tokens
+    ]
+    assert [token.line for token in tokens] == [1, 2, 3]
@@ -0,0 +1,58 @@
+import shutil
+import pytest
+from gpt_optimize.jsvalidator import PrettierWorker, PrettierWorkerError
+
+needs_node = pytest.mark.skipif(shutil.which("node") is None, reason="needs Node")
+
+
+def broken_worker(tmp_path, script):
+    path = tmp_path / "worker.js"
+    path.write_text(script)
+    worker = PrettierWorker(max_restarts=2, timeout=5)
+    worker.script_path = str(path)
+    # Never install anything globally from the tests
+    worker.install_prettier = lambda: False
+    return worker
+
+
+@needs_node
+def test_gives_up_once_and_for_all(tmp_path):
+    worker = broken_worker(
+        tmp_path,
+        'console.log(JSON.stringify({id: null, ok: false, error: "Cannot load '
+        'prettier: missing"}));\nprocess.exit(1);\n',
+    )
+    assert "giving up" in worker.check()
+    with pytest.raises(PrettierWorkerError):
+        worker.format("const a = 1;")
+    assert worker.process is None
+    worker.close()
+
+
+@needs_node
+def test_code_crashing_the_worker_is_invalid(tmp_path):
+    worker = broken_worker(
+        tmp_path,
+        'const readline = require("readline");\n'
+        "readline.createInterface({ input: process.stdin }).on('line', (line) => {\n"
+        "  const request = JSON.parse(line);\n"
+        "  if (request.source.includes('crash')) process.exit(1);\n"
+        "  console.log(JSON.stringify({id: request.id, ok: true, formatted: request.source}));\n"
+        "});\n",
+    )
+    assert worker.format_many(["a;", "crash;", "b;"]) == [
+        (True, "a;"),
+        (False, "Prettier crashed on this code: Prettier worker exited"),
+        (True, "b;"),
+    ]
+    assert worker.check() is None
+    worker.close()
+    assert worker.process is None
+
+
+def test_missing_node(monkeypatch):
+    monkeypatch.setenv("PATH", "")
+    worker = PrettierWorker()
+    assert worker.check().startswith("Cannot start the Prettier worker")
+    with pytest.raises(PrettierWorkerError):
+        worker.format("const a = 1;")
@@ -0,0 +1,37 @@
+import os
+from gpt_optimize.manifest import Manifest
+
+
+def test_path_sits_next_to_the_output(tmp_path):
+    output = str(tmp_path / "output")
+    assert Manifest.path_for(output + os.sep) == str(tmp_path / "output.manifest.jsonl")
+
+
+def test_up_to_date(tmp_path):
+    input_path = tmp_path / "a.js"
+    input_path.write_bytes(b"const a = 1;\r\n")
+    output_path = str(tmp_path / "out.js")
+    manifest = Manifest(str(tmp_path / "manifest.jsonl"))
+    input_hash = Manifest.hash_file(str(input_path))
+    manifest.record(str(input_path), input_hash, "p1", "m1", "success", output_path)
+    # The output must still exist
+    assert not manifest.is_up_to_date(str(input_path), input_hash, "p1", "m1")
+    open(output_path, "w").close()
+    assert manifest.is_up_to_date(str(input_path), input_hash, "p1", "m1")
+    assert not manifest.is_up_to_date(str(input_path), "other", "p1", "m1")
+    assert not manifest.is_up_to_date(str(input_path), input_hash, "p2", "m1")
+    assert not manifest.is_up_to_date(str(input_path), input_hash, "p1", "m2")
+    manifest.record(str(input_path), input_hash, "p1", "m1", "degraded", output_path)
+    assert not manifest.is_up_to_date(str(input_path), input_hash, "p1", "m1")
+
+
+def test_reload_skips_a_truncated_line(tmp_path):
+    path = str(tmp_path / "manifest.jsonl")
+    output_path = str(tmp_path / "out.js")
+    open(output_path, "w").close()
+    Manifest(path).record("a.js", "h", "p", "m", "success", output_path)
+    with open(path, "a", encoding="utf-8") as file:
+        file.write('{"input": "b.js", "outp')
+    manifest = Manifest(path)
+    assert list(manifest.records) == ["a.js"]
+    assert manifest.is_up_to_date("./a.js", "h", "p", "m")
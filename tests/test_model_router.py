@@ -0,0 +1,54 @@
+import pytest
+from gpt_optimize.model_router import ModelRouter, ModelTooSmallError
+
+SMALL = "gpt-3.5-turbo-0613"
+LARGE = "gpt-3.5-turbo-16k"
+
+
+def test_cheapest_fitting_model():
+    router = ModelRouter()
+    assert router.choose("optimise", 1500) == SMALL
+    # Prompt and expected completion no longer fit 4k
+    assert router.choose("optimise", 3000) == LARGE
+
+
+def test_validation_stays_on_the_small_model():
+    assert ModelRouter().choose("validate", 3000) == SMALL
+
+
+def test_largest_context_when_nothing_fits_whole():
+    assert ModelRouter().choose("optimise", 9000) == LARGE
+
+
+def test_too_large_for_every_model():
+    with pytest.raises(ModelTooSmallError):
+        ModelRouter().choose("optimise", 20000)
+
+
+def test_pinned_model_kept_while_it_fits():
+    router = ModelRouter()
+    assert router.choose("optimise", 1000, "gpt-4") == "gpt-4"
+    assert router.choose("optimise", 6000, "gpt-4") == LARGE
+    # Unknown to the tables: trusted as it is
+    assert router.choose("optimise", 1000, "gpt-4o") == "gpt-4o"
+    assert router.expected_output("optimise", 1000, "gpt-4o") == 1000
+
+
+def test_failing_model_is_avoided_then_recovers():
+    router = ModelRouter(failure_half_life=1)
+    for failed in (True, True, False, True, True, False):
+        router.record(SMALL, failed)
+    assert router.choose("optimise", 1000) == LARGE
+    # Pretend the failures happened long ago
+    router._stats[SMALL][2] -= 60
+    assert router.failure_rate(SMALL) == 0.0
+    assert router.choose("optimise", 1000) == SMALL
+
+
+def test_config_overrides_tables():
+    router = ModelRouter(
+        models={"local": {"context": 32000, "input_price": 0, "output_price": 0}},
+        operations={"optimise": {"models": [SMALL, "local"]}},
+    )
+    assert router.choose("optimise", 1000) == "local"
+    assert router.version() != ModelRouter().version()
@@ -0,0 +1,138 @@
+import logging
+from gpt_optimize.openai_helper import OpenAiHelper
+from gpt_optimize.backends import StubBackend
+from gpt_optimize.budget import FileBudget
+from gpt_optimize.model_router import ModelRouter
+from gpt_optimize.jsvalidator import PrettierWorkerError
+
+CODE = """import React from "react";
+import Button from "./components/Button";
+
+export default function App() {
+  return <Button label="Save" />;
+}"""
+
+
+class WordCounter:
+    # Stands in for tiktoken, which needs to download its encodings
+    def count(self, text):
+        return len(text.split())
+
+    def count_messages(self, messages):
+        return sum(self.count(message["content"]) for message in messages)
+
+
+class KnownSources:
+    # Only the given sources parse
+    def __init__(self, *sources):
+        self.sources = {source.strip() for source in sources}
+
+    def format(self, source, parser="babel"):
+        if source.strip() in self.sources:
+            return True, source
+        return False, "SyntaxError: Unexpected token"
+
+
+def create_helper(backend, formatter=None, **options):
+    return OpenAiHelper(
+        None,
+        logging.getLogger("test"),
+        backend=backend,
+        token_counter=WordCounter(),
+        formatter=formatter or KnownSources(CODE),
+        **options,
+    )
+
+
+def small_model_router(context):
+    return ModelRouter(
+        models={"small": {"context": context, "max_output": context}},
+        operations={"optimise": {"models": ["small"]}},
+    )
+
+
+def module(parts):
+    return 'import React from "react";\n\n' + "\n\n".join(
+        f"export function Part{index}() {{\n  return <p>{index}</p>;\n}}"
+        for index in range(parts)
+    )
+
+
+def test_continued_answer_is_validated_whole():
+    helper = create_helper(StubBackend(truncate_rate=0.5, seed=4))
+    budget = FileBudget()
+    assert helper.process_code(CODE, "optimise", budget=budget).strip() == CODE
+    assert not budget.degraded
+    assert [event["stage"] for event in helper.metrics.events].count(
+        "continuation"
+    ) == 3
+
+
+def test_truncated_answer_is_not_kept_when_budget_runs_out():
+    # Every answer is cut short, the continuations exhaust the budget
+    helper = create_helper(StubBackend(truncate_rate=1.0))
+    budget = FileBudget(max_tokens=100)
+    assert helper.process_code(CODE, "optimise", budget=budget) is None
+
+
+class RejectsFirstReview(StubBackend):
+    # The review turns down every candidate the first time it sees it
+    def __init__(self):
+        super().__init__()
+        self.reviewed = set()
+
+    def _respond(self, model, messages, rng, attempt, key):
+        if "validate" in messages[0]["content"]:
+            code = messages[-1]["content"]
+            if code not in self.reviewed:
+                self.reviewed.add(code)
+                response = super()._respond(model, messages, rng, attempt, key)
+                response.choices[0].message["content"] = "invalid:\n- Try again."
+                return response
+        return super()._respond(model, messages, rng, attempt, key)
+
+
+class ParsesAll:
+    def format(self, source, parser="babel"):
+        return True, source
+
+
+def test_each_chunk_gets_its_own_iterations():
+    # The prompt alone is about 150 words: a chunk fits 400, the file does not
+    helper = create_helper(
+        RejectsFirstReview(),
+        ParsesAll(),
+        router=small_model_router(400),
+        chunk_tokens=10,
+    )
+    budget = FileBudget(max_iterations=2)
+    optimised_code = helper.process_code(module(10), "optimise", budget=budget)
+    assert optimised_code.count("export function Part") == 10
+    assert not budget.degraded
+    assert budget.iterations == 0 and budget.tokens > 0
+
+
+def test_files_that_fit_a_model_are_not_chunked():
+    helper = create_helper(StubBackend(), ParsesAll(), chunk_tokens=10)
+    code = module(10)
+    assert not helper.should_chunk(
+        code,
+        helper._prepare_user_content("optimise"),
+        helper._prepare_system_content("optimise"),
+    )
+    assert helper.process_code(code, "optimise").strip() == code
+    calls = [event for event in helper.metrics.events if event["stage"] == "api_call"]
+    # One optimisation and its review
+    assert len(calls) == 2
+
+
+class BrokenFormatter:
+    def format(self, source, parser="babel"):
+        raise PrettierWorkerError("Prettier worker keeps failing, giving up")
+
+
+def test_broken_prettier_costs_one_call():
+    helper = create_helper(StubBackend(), BrokenFormatter())
+    assert helper.process_code(CODE, "optimise", budget=FileBudget()) is None
+    calls = [event for event in helper.metrics.events if event["stage"] == "api_call"]
+    assert len(calls) == 1
@@ -0,0 +1,70 @@
+import os
+import json
+import zipfile
+from gpt_optimize.output_writer import TreeWriter, create_writer
+
+
+def test_when_written_waits_for_flush(tmp_path):
+    writer = TreeWriter()
+    path = str(tmp_path / "src" / "a.js")
+    written = []
+    writer.write(path, "const a = 1;\n")
+    writer.when_written(path, lambda: written.append(os.path.exists(path)))
+    assert written == [] and not os.path.exists(path)
+    # Held back files are still readable
+    assert writer.read(path) == "const a = 1;\n"
+    writer.flush()
+    assert written == [True]
+    writer.when_written(path, lambda: written.append("again"))
+    assert written == [True, "again"]
+
+
+def test_large_write_replaces_pending_small_one(tmp_path):
+    writer = TreeWriter(small_file_bytes=16)
+    path = str(tmp_path / "a.js")
+    written = []
+    writer.write(path, "small\n")
+    writer.when_written(path, lambda: written.append(True))
+    writer.write(path, "x" * 32)
+    assert written == [True]
+    writer.flush()
+    with open(path, encoding="utf-8") as file:
+        assert file.read() == "x" * 32
+    assert [name for name in os.listdir(tmp_path)] == ["a.js"]
+
+
+def test_groups_are_flushed_when_full(tmp_path):
+    writer = TreeWriter(flush_files=2)
+    writer.write(str(tmp_path / "a.js"), "a\n")
+    assert os.listdir(tmp_path) == []
+    writer.write(str(tmp_path / "b.js"), "b\n")
+    assert sorted(os.listdir(tmp_path)) == ["a.js", "b.js"]
+
+
+def test_archive_formats(tmp_path):
+    for output_format in ("zip", "jsonl"):
+        output = str(tmp_path / output_format / "output")
+        writer = create_writer(output_format, output)
+        written = []
+        writer.write(os.path.join(output, "src", "b.js"), "b\n")
+        writer.write(os.path.join(output, "a.js"), "a\n")
+        writer.when_written(os.path.join(output, "a.js"), lambda: written.append(1))
+        writer.flush()
+        assert written == [] and not os.path.exists(f"{output}.{output_format}")
+        assert writer.read(os.path.join(output, "src", "b.js")) == "b\n"
+        writer.close()
+        assert written == [1]
+        if output_format == "zip":
+            with zipfile.ZipFile(f"{output}.zip") as archive:
+                contents = {
+                    name: archive.read(name).decode() for name in archive.namelist()
+                }
+        else:
+            with open(f"{output}.jsonl", encoding="utf-8") as file:
+                contents = {
+                    record["path"]: record["content"]
+                    for record in map(json.loads, file)
+                }
+        assert contents == {"a.js": "a\n", "src/b.js": "b\n"}
+        # Nothing else next to the archive, the temp file was renamed
+        assert os.listdir(os.path.dirname(output)) == [f"output.{output_format}"]
@@ -0,0 +1,40 @@
+import os
+from gpt_optimize.result_cache import ResultCache
+
+
+def key(name):
+    return ResultCache.make_key("model", "optimise", "system", "user", name, 0.5)
+
+
+def test_round_trip_and_keys(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    assert cache.get(key("a")) is None
+    cache.set(key("a"), ["const a = 1;"])
+    assert cache.get(key("a")) == ["const a = 1;"]
+    assert key("a") != key("b")
+    assert key("a") != ResultCache.make_key(
+        "other", "optimise", "system", "user", "a", 0.5
+    )
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    value = "x" * 100
+    entry_size = len(f'"{value}"')
+    cache = ResultCache(str(tmp_path), max_size=3 * entry_size)
+    for age, name in enumerate(["a", "b", "c"]):
+        cache.set(key(name), value)
+        # Oldest first, whatever the file system's mtime resolution
+        os.utime(cache._path(key(name)), (1000 + age, 1000 + age))
+    # Reading a refreshes it, b is now the least recently used
+    assert cache.get(key("a")) == value
+    cache.set(key("d"), value)
+    assert cache.get(key("b")) is None
+    assert [cache.get(key(name)) for name in "acd"] == [value] * 3
+    assert cache._size == 3 * entry_size
+
+
+def test_size_is_known_after_reopening(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.set(key("a"), "value")
+    cache.set(key("a"), "longer value")
+    assert ResultCache(str(tmp_path))._size == cache._size == len('"longer value"')
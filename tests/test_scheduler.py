@@ -0,0 +1,77 @@
+from gpt_optimize.scheduler import (
+    topological_waves,
+    export_signatures,
+    dependency_context,
+)
+
+
+def test_waves_follow_dependencies():
+    dependencies = {
+        "app": {"button", "api"},
+        "button": {"theme"},
+        "api": set(),
+        "theme": set(),
+    }
+    assert topological_waves(dependencies) == [["api", "theme"], ["button"], ["app"]]
+
+
+def test_unknown_and_self_dependencies_are_ignored():
+    assert topological_waves({"a": {"a", "react"}, "b": {"a"}}) == [["a"], ["b"]]
+
+
+def test_cycles_share_a_wave():
+    dependencies = {"a": {"b"}, "b": {"a"}, "c": {"a"}, "d": set()}
+    assert topological_waves(dependencies) == [["a", "b", "d"], ["c"]]
+
+
+def test_files_importing_a_cycle_keep_their_order():
+    dependencies = {
+        "a": {"b"},
+        "b": {"a"},
+        "c": {"a"},
+        "d": {"c"},
+        "e": {"d"},
+        "x": {"y"},
+        "y": {"z"},
+        "z": {"x", "e"},
+    }
+    assert topological_waves(dependencies) == [
+        ["a", "b"],
+        ["c"],
+        ["d"],
+        ["e"],
+        ["x", "y", "z"],
+    ]
+
+
+def test_long_chains_do_not_recurse():
+    dependencies = {index: {index - 1} if index else set() for index in range(5000)}
+    waves = topological_waves(dependencies)
+    assert waves[0] == [0] and waves[-1] == [4999] and len(waves) == 5000
+
+
+def test_export_signatures():
+    source = """export default function Card({ title, children }) {
+  return null;
+}
+export const useThing = (a, b = 2) => a + b;
+export const LIMIT = 10;
+export { Card as Tile, helper };
+export class Store extends Base {}
+"""
+    assert export_signatures(source) == [
+        "export default function Card({ title, children })",
+        "export const useThing = (a, b = 2) =>",
+        "export const LIMIT",
+        "export { Card as Tile, helper }",
+        "export class Store extends Base",
+    ]
+
+
+def test_dependency_context():
+    signatures = {"/src/ui/Button.jsx": ["export default function Button()"]}
+    context = dependency_context(
+        "/src/app/App.jsx", {"/src/ui/Button.jsx", "/src/missing.js"}, signatures
+    )
+    assert context.endswith("../ui/Button.jsx: export default function Button()")
+    assert dependency_context("/src/a.js", {"/src/b.js"}, {}) is None
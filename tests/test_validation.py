@@ -0,0 +1,33 @@
+from gpt_optimize.jsvalidator import PrettierWorkerError
+from gpt_optimize.validation import (
+    SyntaxStage,
+    StructureStage,
+    ValidationPipeline,
+    exported_names,
+)
+
+
+class BrokenFormatter:
+    def format(self, source, parser="babel"):
+        raise PrettierWorkerError("Prettier worker keeps failing, giving up")
+
+
+def test_broken_prettier_is_terminal():
+    result = ValidationPipeline([SyntaxStage(BrokenFormatter())]).run("a;", "a;")
+    assert not result.valid
+    assert result.terminal
+    assert result.passed_stages == 0
+
+
+def test_structure_stage():
+    original = "import A from './a';\nexport const x = 1;\nexport default A;\n"
+    result = StructureStage().validate("export default A;\n", original)
+    assert not result.valid
+    assert "exports are missing: x" in result.feedback
+    result = StructureStage().validate(original + "import B from './b';\n", original)
+    assert "relative imports were added: ./b" in result.feedback
+
+
+def test_exported_names():
+    source = "export { a, b as c };\nexport async function d() {}\nexport default 1;"
+    assert exported_names(source) == {"a", "c", "d", "default"}